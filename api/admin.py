@@ -1,10 +1,15 @@
 from django.contrib import admin
-from .models import Data, ExportMethod, ProcessedData, DataType, Nerf, NerfModel, NerfObject
+from .models import Data, DataUpload, ExportMethod, ProcessedData, DataType, Nerf, NerfModel, NerfObject, NerfObjectLod, NerfObjectTexture, Sweep, UserQuota
 
 admin.site.register(Data)
+admin.site.register(DataUpload)
 admin.site.register(ProcessedData)
 admin.site.register(DataType)
 admin.site.register(Nerf)
 admin.site.register(ExportMethod)
 admin.site.register(NerfModel)
 admin.site.register(NerfObject)
+admin.site.register(NerfObjectLod)
+admin.site.register(NerfObjectTexture)
+admin.site.register(Sweep)
+admin.site.register(UserQuota)
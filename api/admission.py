@@ -0,0 +1,44 @@
+import os
+import shutil
+
+from django.conf import settings
+from rest_framework import status
+from rest_framework.exceptions import APIException, Throttled
+
+from .predictions import drain_time, stage_backlog
+
+class ServiceUnavailable(APIException):
+    """ 503 with a Retry-After header, which DRF's exception handler adds from `wait`. """
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Service temporarily unavailable, try again later.'
+    default_code = 'service_unavailable'
+
+    def __init__(self, detail=None, wait=None):
+        super().__init__(detail)
+        self.wait = wait
+
+def check_disk_space() -> None:
+    if not settings.ADMISSION_MIN_FREE_DISK or not os.path.isdir(settings.MEDIA_ROOT):
+        return
+    if shutil.disk_usage(settings.MEDIA_ROOT).free < settings.ADMISSION_MIN_FREE_DISK:
+        raise ServiceUnavailable('Not enough free disk space to take new jobs.',
+                                 wait=settings.ADMISSION_DISK_RETRY_AFTER)
+
+def check_admission(jobs: dict) -> None:
+    """
+    Lets a request that queues `jobs` ({stage: count}) through, or rejects it:
+    503 when media storage runs out of space, 429 when a stage would hold more
+    than ADMISSION_MAX_BACKLOG queued jobs. Both carry a Retry-After, for a 429
+    the time the stage's workers need to drain the excess.
+    """
+    check_disk_space()
+
+    for stage, count in jobs.items():
+        limit = settings.ADMISSION_MAX_BACKLOG[stage]
+        if not limit or not count:
+            continue
+        backlog = stage_backlog(stage)
+        excess = backlog['queued'] + count - limit
+        if excess > 0:
+            raise Throttled(wait=drain_time(stage, excess, backlog['in_flight']),
+                            detail=f'Too many {stage} jobs queued.')
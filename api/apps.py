@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class NerfcfmConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        from . import events  # connects the job event signals
@@ -0,0 +1,239 @@
+import gzip
+import io
+import os
+import re
+import shutil
+import zipfile
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+
+# optional, not in requirements: without it only gzip siblings are written
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+FILE_CHUNK_SIZE = 64 * 1024
+RANGE_HEADER_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+# content-coding -> sibling file suffix, in order of preference
+PRECOMPRESSED_SUFFIXES = {
+    'br': '.br',
+    'gzip': '.gz',
+}
+
+def write_precompressed_variants(file_path: str) -> [str]:
+    """ Writes gzip (and brotli, when available) siblings of a file and returns their paths. """
+    variants = []
+
+    gzip_path = file_path + PRECOMPRESSED_SUFFIXES['gzip']
+    with open(file_path, 'rb') as source, gzip.open(gzip_path, 'wb', compresslevel=9) as target:
+        shutil.copyfileobj(source, target, FILE_CHUNK_SIZE)
+    variants.append(gzip_path)
+
+    if brotli:
+        brotli_path = file_path + PRECOMPRESSED_SUFFIXES['br']
+        compressor = brotli.Compressor(quality=settings.PRECOMPRESSED_BROTLI_QUALITY)
+        with open(file_path, 'rb') as source, open(brotli_path, 'wb') as target:
+            for chunk in iter(lambda: source.read(FILE_CHUNK_SIZE), b''):
+                target.write(compressor.process(chunk))
+            target.write(compressor.finish())
+        variants.append(brotli_path)
+
+    return variants
+
+def parse_accept_encoding(accept_encoding: str) -> dict:
+    """ Maps each content-coding of an Accept-Encoding header to its q-value. """
+    codings = {}
+    for item in accept_encoding.split(','):
+        coding, _, params = item.strip().partition(';')
+        if not coding:
+            continue
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        codings[coding.strip().lower()] = quality
+    return codings
+
+def negotiate_precompressed(request, file_path: str):
+    """ Picks the best precompressed sibling the client accepts, as (suffix, content-coding). """
+    codings = parse_accept_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+    for coding, suffix in PRECOMPRESSED_SUFFIXES.items():
+        quality = codings.get(coding, codings.get('*', 0.0))
+        if quality > 0 and os.path.exists(file_path + suffix):
+            return suffix, coding
+    return '', None
+
+def read_file_chunks(file_path: str, start: int, length: int, chunk_size: int = FILE_CHUNK_SIZE):
+    """ Yields `length` bytes of a file starting at `start`, one chunk at a time. """
+    with open(file_path, 'rb') as file:
+        file.seek(start)
+        remaining = length
+        while remaining > 0:
+            chunk = file.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+def parse_range_header(range_header: str, file_size: int):
+    """
+    Parses a single `bytes=` range against the file size.
+
+    Returns an inclusive (start, end) tuple, None when the header should be
+    ignored (malformed or multipart ranges), and raises ValueError when the
+    range cannot be satisfied.
+    """
+    match = RANGE_HEADER_RE.match(range_header.strip())
+    if not match:
+        return None
+
+    first, last = match.groups()
+    if not first and not last:
+        return None
+
+    if not first:
+        # suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            raise ValueError('Empty suffix range')
+        if file_size == 0:
+            raise ValueError('Range not satisfiable')
+        return max(file_size - length, 0), file_size - 1
+
+    start = int(first)
+    end = int(last) if last else file_size - 1
+    if start >= file_size or end < start:
+        raise ValueError('Range not satisfiable')
+
+    return start, min(end, file_size - 1)
+
+def offload_response(file_path: str, file_name: str, content_type: str):
+    """ Hands the transfer over to the front web server (X-Sendfile / X-Accel-Redirect). """
+    response = HttpResponse(content_type=content_type)
+    if settings.FILE_SERVE_OFFLOAD == 'x-accel-redirect':
+        response['X-Accel-Redirect'] = f'{settings.FILE_SERVE_ACCEL_PREFIX}{file_name}'
+    else:
+        response['X-Sendfile'] = file_path
+    return response
+
+def set_validator_headers(response, etag: str = None, last_modified=None, vary_encoding: bool = False):
+    """ Adds the caching validators of an immutable artifact to a response. """
+    if vary_encoding:
+        patch_vary_headers(response, ['Accept-Encoding'])
+    if etag:
+        response['ETag'] = etag
+    if last_modified:
+        response['Last-Modified'] = http_date(last_modified.timestamp())
+    patch_cache_control(response, max_age=settings.ARTIFACT_CACHE_MAX_AGE, immutable=True)
+
+def file_download_response(request, file_field, content_type: str = 'application/octet-stream',
+                           content_hash: str = '', last_modified=None, precompressed: bool = False):
+    """
+    Streams a stored file without loading it in memory.
+
+    Honors single `Range` requests with `206 Partial Content`, and delegates the
+    transfer to the front server when FILE_SERVE_OFFLOAD is configured. When the
+    content hash or modification date is known, conditional requests are answered
+    with `304 Not Modified`. With `precompressed`, a gzip/brotli sibling written at
+    export time is sent instead of the raw file if the client accepts it.
+    """
+    suffix, content_encoding = negotiate_precompressed(request, file_field.path) if precompressed else ('', None)
+    file_path = file_field.path + suffix
+
+    etag = None
+    if content_hash:
+        etag = quote_etag(f'{content_hash}-{content_encoding}' if content_encoding else content_hash)
+
+    if etag or last_modified:
+        not_modified = get_conditional_response(
+            request,
+            etag=etag,
+            last_modified=int(last_modified.timestamp()) if last_modified else None)
+        if not_modified is not None:
+            set_validator_headers(not_modified, etag, last_modified, precompressed)
+            return not_modified
+
+    if settings.FILE_SERVE_OFFLOAD:
+        response = offload_response(file_path, file_field.name + suffix, content_type)
+    else:
+        file_size = os.path.getsize(file_path)
+        range_header = request.META.get('HTTP_RANGE')
+
+        # a stale If-Range validator means the client gets the whole file
+        if_range = request.META.get('HTTP_IF_RANGE')
+        if range_header and if_range and if_range != etag:
+            range_header = None
+
+        try:
+            byte_range = parse_range_header(range_header, file_size) if range_header else None
+        except ValueError:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{file_size}'
+            return response
+
+        if byte_range:
+            start, end = byte_range
+            length = end - start + 1
+            response = StreamingHttpResponse(read_file_chunks(file_path, start, length),
+                                             status=206, content_type=content_type)
+            response['Content-Length'] = str(length)
+            response['Content-Range'] = f'bytes {start}-{end}/{file_size}'
+        else:
+            response = FileResponse(open(file_path, 'rb'), content_type=content_type)
+            response['Content-Length'] = str(file_size)
+
+    set_validator_headers(response, etag, last_modified, precompressed)
+    if content_encoding:
+        response['Content-Encoding'] = content_encoding
+    response['Accept-Ranges'] = 'bytes'
+    response['Content-Disposition'] = f'inline; filename={file_field.name}'
+    return response
+
+class ZipStreamBuffer(io.RawIOBase):
+    """ Write-only sink that lets zipfile produce an archive one chunk at a time. """
+
+    def __init__(self):
+        self.chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def pop(self) -> bytes:
+        data = b''.join(self.chunks)
+        self.chunks.clear()
+        return data
+
+def zip_stream(files: [tuple], chunk_size: int = FILE_CHUNK_SIZE):
+    """
+    Yields a zip archive built on the fly from (file_path, arcname, compress_type)
+    tuples, holding at most one chunk of each member in memory.
+    """
+    buffer = ZipStreamBuffer()
+    with zipfile.ZipFile(buffer, mode='w') as archive:
+        for file_path, arcname, compress_type in files:
+            member = zipfile.ZipInfo.from_file(file_path, arcname)
+            member.compress_type = compress_type
+            with open(file_path, 'rb') as source, archive.open(member, mode='w') as target:
+                for chunk in iter(lambda: source.read(chunk_size), b''):
+                    target.write(chunk)
+                    yield buffer.pop()
+            yield buffer.pop()
+    yield buffer.pop()
+
+def zip_download_response(files: [tuple], filename: str):
+    """ Streams a zip of the given files without temp files or full buffering. """
+    response = StreamingHttpResponse(zip_stream(files), content_type='application/zip')
+    response['Content-Disposition'] = f'attachment; filename={filename}'
+    return response
@@ -0,0 +1,96 @@
+import asyncio
+import json
+
+import redis
+import redis.asyncio as aioredis
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from .models import ProcessedData, NerfModel, NerfObject
+
+# job model -> `type` of its events
+JOB_EVENT_TYPES = {
+    ProcessedData: 'processed_data',
+    NerfModel: 'nerf_model',
+    NerfObject: 'nerf_object',
+}
+
+JOB_EVENT_FIELDS = ['status', 'progress', 'progress_stage', 'start_date', 'end_date', 'estimated_end_date']
+
+publisher = None
+
+def job_channel(user_id: int) -> str:
+    """ Redis pub/sub channel carrying the job events of a user. """
+    return f'{settings.JOB_EVENTS_CHANNEL_PREFIX}{user_id}'
+
+def job_event(instance) -> dict:
+    event = {'type': JOB_EVENT_TYPES[type(instance)], 'id': instance.id}
+    for field in JOB_EVENT_FIELDS:
+        event[field] = getattr(instance, field)
+    return event
+
+def format_event(event: dict) -> str:
+    """ Frames a job event as a Server-Sent Event. """
+    return f'event: job\ndata: {json.dumps(event, cls=DjangoJSONEncoder)}\n\n'
+
+def publish_job_event(instance) -> None:
+    """ Pushes the current status and progress of a job to the streams of its owner. """
+    publish_job_events([instance])
+
+def publish_job_events(instances) -> None:
+    """ Pushes the events of many jobs in a single round trip to Redis. """
+    global publisher
+    if not settings.JOB_EVENTS_REDIS_URL or not instances:
+        return
+    if publisher is None:
+        publisher = redis.Redis.from_url(settings.JOB_EVENTS_REDIS_URL, socket_timeout=1)
+
+    # a missed event only delays the client until the next one, never fail the job for it
+    try:
+        pipeline = publisher.pipeline(transaction=False)
+        for instance in instances:
+            pipeline.publish(job_channel(instance.user_id), json.dumps(job_event(instance), cls=DjangoJSONEncoder))
+        pipeline.execute()
+    except redis.RedisError as e:
+        print(f"[JOB_EVENTS]: PUBLISH ERROR {e}")
+
+@receiver(post_save, sender=ProcessedData)
+@receiver(post_save, sender=NerfModel)
+@receiver(post_save, sender=NerfObject)
+def publish_saved_job(sender, instance, **kwargs):
+    transaction.on_commit(lambda: publish_job_event(instance))
+
+async def job_event_stream(user):
+    """
+    Yields the user's running jobs, then every event published for them,
+    with a comment line when idle so proxies keep the connection open.
+
+    The stream ends after JOB_EVENTS_MAX_DURATION and EventSource reconnects
+    (getting a fresh snapshot), since the ASGI handler does not stop streaming
+    when the client goes away: a closed stream holds its Redis connection until then.
+    """
+    deadline = asyncio.get_running_loop().time() + settings.JOB_EVENTS_MAX_DURATION
+    client = aioredis.Redis.from_url(settings.JOB_EVENTS_REDIS_URL)
+    pubsub = client.pubsub()
+    # subscribe first, so nothing that happens during the snapshot is lost
+    await pubsub.subscribe(job_channel(user.id))
+    try:
+        yield f'retry: {settings.JOB_EVENTS_RECONNECT_DELAY * 1000}\n\n'
+        for model in JOB_EVENT_TYPES:
+            async for job in model.objects.filter(user=user, status='in_progress'):
+                yield format_event(job_event(job))
+
+        while (remaining := deadline - asyncio.get_running_loop().time()) > 0:
+            message = await pubsub.get_message(ignore_subscribe_messages=True,
+                                               timeout=min(settings.JOB_EVENTS_HEARTBEAT, remaining))
+            if message is None:
+                yield ': keepalive\n\n'
+            else:
+                yield f"event: job\ndata: {message['data'].decode()}\n\n"
+    finally:
+        await pubsub.unsubscribe()
+        await pubsub.close()
+        await client.close()
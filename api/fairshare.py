@@ -0,0 +1,121 @@
+"""
+Fair share of the GPU stages (training and export) between users.
+
+Tasks are consumed in queue order, so a user who submits many jobs at once would
+hold every worker. Instead, before its command starts, a task gives its worker up
+(see `wait_for_turn` in utils) when its user already runs as many jobs of the
+stage as allowed, or when another user whose task is waiting for its turn has
+used fewer weighted GPU-seconds of the stage over FAIR_SHARE_WINDOW. The user
+with the least usage never waits on the others, so the workers always have work.
+
+A job waits for its turn from when it is ready for a worker (its previous stage
+ended) until it starts, whether or not its task has reached a worker yet: while
+every worker is busy, a task behind others in the queue cannot ask. A job still
+waiting after the stage's timeout is taken to have lost its task, e.g. when
+publishing it failed, and no longer holds the other users back.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Count, DurationField, ExpressionWrapper, F, Q, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from nerfcfm.celery import TRAIN_MODEL_QUEUE, EXPORT_OBJECT_QUEUE
+from .models import UserQuota
+from .predictions import STAGE_MODELS, job_stage
+
+# fair-shared stage -> UserQuota field capping it
+FAIR_SHARE_STAGES = {
+    TRAIN_MODEL_QUEUE: 'max_running_trainings',
+    EXPORT_OBJECT_QUEUE: 'max_running_exports',
+}
+# fair-shared stage -> (field of the job it builds on, setting with its command's timeout)
+STAGE_UPSTREAMS = {
+    TRAIN_MODEL_QUEUE: ('processed_data', 'TRAIN_MODEL_TIMEOUT'),
+    EXPORT_OBJECT_QUEUE: ('nerf_model', 'EXPORT_OBJECT_TIMEOUT'),
+}
+
+def user_caps(stage: str, user_ids) -> dict:
+    """ Jobs of `stage` each user may run at once, 0 for no cap. """
+    cap_field = FAIR_SHARE_STAGES[stage]
+    caps = {user_id: settings.FAIR_SHARE_MAX_RUNNING[stage] for user_id in user_ids}
+    for quota in UserQuota.objects.filter(user_id__in=user_ids):
+        if getattr(quota, cap_field) is not None:
+            caps[quota.user_id] = getattr(quota, cap_field)
+    return caps
+
+def user_weights(user_ids) -> dict:
+    weights = {user_id: 1.0 for user_id in user_ids}
+    for user_id, weight in UserQuota.objects.filter(user_id__in=user_ids).values_list('user_id', 'weight'):
+        weights[user_id] = max(weight, 0.01)
+    return weights
+
+def running_jobs(stage: str, user_ids, exclude_id: int = None) -> dict:
+    """
+    Jobs of `stage` each user runs, counted from when they take their turn so that
+    exports still waiting for a GPU slot count too. `exclude_id` leaves out the job
+    asking, which took its turn already when its task is delivered again.
+    """
+    counts = (STAGE_MODELS[stage].objects
+              .filter(Q(turn_taken_at__isnull=False) | Q(started_at__isnull=False),
+                      user_id__in=user_ids, status='in_progress', cache_source__isnull=True)
+              .exclude(id=exclude_id)
+              .values('user_id')
+              .annotate(count=Count('id')))
+    return {row['user_id']: row['count'] for row in counts}
+
+def gpu_seconds(stage: str, user_ids) -> dict:
+    """ Seconds each user's jobs of `stage` ran for, those running so far included, over FAIR_SHARE_WINDOW. """
+    now = timezone.now()
+    run_time = ExpressionWrapper(Coalesce(F('finished_at'), Value(now)) - F('started_at'), output_field=DurationField())
+    rows = (STAGE_MODELS[stage].objects
+            .filter(Q(finished_at__isnull=True) | Q(finished_at__gte=now - timedelta(seconds=settings.FAIR_SHARE_WINDOW)),
+                    user_id__in=user_ids, started_at__isnull=False, cache_source__isnull=True)
+            .values('user_id')
+            .annotate(run_time=Sum(run_time)))
+    usage = {user_id: 0.0 for user_id in user_ids}
+    usage.update({row['user_id']: row['run_time'].total_seconds() for row in rows if row['run_time']})
+    return usage
+
+def waiting_users(instance) -> set:
+    """
+    Other users with a job of the same stage that is ready for a worker and not
+    started yet, for no longer than the stage's timeout.
+    """
+    upstream, timeout = STAGE_UPSTREAMS[job_stage(instance)]
+    since = timezone.now() - timedelta(seconds=getattr(settings, timeout))
+    return set(type(instance).objects
+               .filter(status='in_progress', cache_source__isnull=True, turn_taken_at__isnull=True,
+                       started_at__isnull=True, **{f'{upstream}__status': 'complete'})
+               .alias(ready_at=Coalesce('queued_at', f'{upstream}__end_date'))
+               .filter(ready_at__gte=since)
+               .exclude(user_id=instance.user_id)
+               .values_list('user_id', flat=True)
+               .distinct())
+
+def fair_share_wait(instance):
+    """
+    Why a job must let other jobs of its stage go first ('cap' or 'share'), or
+    None when it may start now. Caps are best effort: two workers checking the
+    same user at once may both start.
+    """
+    stage = job_stage(instance)
+    if stage not in FAIR_SHARE_STAGES:
+        return None
+
+    others = waiting_users(instance)
+    user_ids = others | {instance.user_id}
+    caps = user_caps(stage, user_ids)
+    running = running_jobs(stage, user_ids, instance.id)
+    if caps[instance.user_id] and running.get(instance.user_id, 0) >= caps[instance.user_id]:
+        return 'cap'
+
+    others = {user_id for user_id in others if not caps[user_id] or running.get(user_id, 0) < caps[user_id]}
+    if not others:
+        return None
+    usage, weights = gpu_seconds(stage, others | {instance.user_id}), user_weights(others | {instance.user_id})
+    share = usage[instance.user_id] / weights[instance.user_id]
+    if any(usage[user_id] / weights[user_id] < share for user_id in others):
+        return 'share'
+    return None
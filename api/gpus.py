@@ -0,0 +1,36 @@
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+
+class GpuSlots:
+    """
+    Bounded pool of GPU slots shared by the subprocesses one worker process runs at once.
+
+    Each GPU takes up to `slots_per_gpu` commands; `acquire` blocks until a slot
+    frees up and yields the id of the least busy GPU, for CUDA_VISIBLE_DEVICES.
+    """
+
+    def __init__(self, gpus: [str], slots_per_gpu: int):
+        self.slots_per_gpu = slots_per_gpu
+        self.busy = {gpu: 0 for gpu in gpus}
+        self.condition = threading.Condition()
+
+    def free_gpu(self):
+        gpu = min(self.busy, key=self.busy.get)
+        return gpu if self.busy[gpu] < self.slots_per_gpu else None
+
+    @contextmanager
+    def acquire(self):
+        with self.condition:
+            self.condition.wait_for(lambda: self.free_gpu() is not None)
+            gpu = self.free_gpu()
+            self.busy[gpu] += 1
+        try:
+            yield gpu
+        finally:
+            with self.condition:
+                self.busy[gpu] -= 1
+                self.condition.notify()
+
+export_slots = GpuSlots(settings.EXPORT_GPUS, settings.EXPORT_SLOTS_PER_GPU)
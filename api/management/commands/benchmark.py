@@ -0,0 +1,215 @@
+import json
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import ExitStack
+
+import numpy as np
+from celery.contrib.testing.worker import start_worker
+from celery.signals import after_task_publish, task_postrun, task_prerun
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.test import Client, override_settings
+from django.test.utils import setup_databases, setup_test_environment, teardown_databases, teardown_test_environment
+from django.utils import timezone
+
+from api.models import User, Data, DataType, Nerf, ExportMethod, NerfObject
+from nerfcfm.celery import app, QUEUE_CONCURRENCY
+
+DATA_TYPES = ['video', 'images']
+NERFS = ['nerfacto', 'instant-ngp', 'splatfacto']
+EXPORT_METHODS = ['tsdf', 'poisson', 'pointcloud']
+
+def percentiles(values: [float]) -> dict:
+    if not values:
+        return {'p50': None, 'p90': None, 'p99': None}
+    p50, p90, p99 = np.percentile(values, [50, 90, 99])
+    return {'p50': round(float(p50), 3), 'p90': round(float(p90), 3), 'p99': round(float(p99), 3)}
+
+class TaskTimes:
+    """ When each task was queued, started and finished, collected from Celery signals. """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.tasks = {}
+
+    def record(self, task_id: str, event: str, **extra) -> None:
+        with self.lock:
+            self.tasks.setdefault(task_id, {}).update({event: time.monotonic(), **extra})
+
+    def on_publish(self, sender=None, headers=None, routing_key=None, **kwargs):
+        self.record(headers['id'], 'published', name=sender, queue=routing_key)
+
+    def on_prerun(self, task_id=None, **kwargs):
+        self.record(task_id, 'started')
+
+    def on_postrun(self, task_id=None, **kwargs):
+        self.record(task_id, 'finished')
+
+class Command(BaseCommand):
+    help = ('Submits pipelines to the REST API at a target rate, runs them on in-process workers '
+            'over an in-memory broker with the nerfstudio simulator, and reports queue wait, '
+            'end-to-end latency percentiles and worker utilization.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--jobs', type=int, default=50, help="Pipelines to submit.")
+        parser.add_argument('--rate', type=float, default=1.0, help="Mean submissions per second (Poisson arrivals).")
+        parser.add_argument('--time-scale', type=float, default=0.01, help="Multiplies the simulated durations.")
+        parser.add_argument('--simulator-config', help="JSON file merged over the simulator's DEFAULT_CONFIG.")
+        parser.add_argument('--users', type=int, default=1, help="Users the pipelines are spread over.")
+        for queue, concurrency in QUEUE_CONCURRENCY.items():
+            parser.add_argument(f'--{queue.replace("_", "-")}-concurrency', type=int, default=concurrency,
+                                dest=f'{queue}_concurrency', help=f"Worker threads on the {queue} queue.")
+        parser.add_argument('--timeout', type=float, default=3600, help="Seconds to wait for the pipelines to end.")
+        parser.add_argument('--seed', type=int, help="Seed for the job mix and the simulator.")
+        parser.add_argument('--json', action='store_true', help="Print the report as JSON.")
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        # celery reads these before its own configuration
+        os.environ['CELERY_BROKER_URL'] = 'memory://'
+        os.environ['CELERY_RESULT_BACKEND'] = 'cache+memory://'
+        os.environ['USE_TEST_SCRIPT'] = '1'
+        os.environ['SIMULATOR_TIME_SCALE'] = str(options['time_scale'])
+        if options['simulator_config']:
+            os.environ['SIMULATOR_CONFIG'] = os.path.abspath(options['simulator_config'])
+        if options['seed'] is not None:
+            os.environ['SIMULATOR_SEED'] = str(options['seed'])
+
+        # everything runs in a scratch directory, against a throwaway database
+        cwd, scratch = os.getcwd(), tempfile.mkdtemp(prefix='nerfcfm-benchmark-')
+        os.chdir(scratch)
+        for directory in ['processed_data', 'nerf_models', 'nerf_objects']:
+            os.makedirs(os.path.join('media', directory))
+        for connection in connections.all():
+            if connection.vendor == 'sqlite':
+                # a file, so the worker threads share it
+                connection.settings_dict['TEST']['NAME'] = os.path.join(scratch, f'{connection.alias}.sqlite3')
+
+        setup_test_environment()
+        old_config = setup_databases(verbosity=0, interactive=False)
+        times = TaskTimes()
+        after_task_publish.connect(times.on_publish, weak=False)
+        task_prerun.connect(times.on_prerun, weak=False)
+        task_postrun.connect(times.on_postrun, weak=False)
+
+        try:
+            # tasks waiting for their fair-share turn check again on the simulated clock
+            retry_delay = settings.FAIR_SHARE_RETRY_DELAY * options['time_scale']
+            with override_settings(MEDIA_ROOT=os.path.join(scratch, 'media'), JOB_EVENTS_REDIS_URL='',
+                                   FAIR_SHARE_RETRY_DELAY=retry_delay), ExitStack() as workers:
+                concurrency = {queue: options[f'{queue}_concurrency'] for queue in QUEUE_CONCURRENCY}
+                for queue, threads in concurrency.items():
+                    workers.enter_context(start_worker(app, concurrency=threads, pool='threads', queues=[queue],
+                                                       perform_ping_check=False, shutdown_timeout=60))
+                report = self.run_benchmark(options, rng, concurrency, times)
+        finally:
+            after_task_publish.disconnect(times.on_publish)
+            task_prerun.disconnect(times.on_prerun)
+            task_postrun.disconnect(times.on_postrun)
+            teardown_databases(old_config, verbosity=0)
+            teardown_test_environment()
+            os.chdir(cwd)
+            shutil.rmtree(scratch, ignore_errors=True)
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+        else:
+            self.write_report(report)
+
+    def run_benchmark(self, options: dict, rng: random.Random, concurrency: dict, times: TaskTimes) -> dict:
+        data_types = [DataType.objects.create(name=name) for name in DATA_TYPES]
+        nerfs = [Nerf.objects.create(name=name) for name in NERFS]
+        export_methods = [ExportMethod.objects.create(name=name) for name in EXPORT_METHODS]
+        clients = []
+        for index in range(options['users']):
+            user, client = User.objects.create(username=f'benchmark-{index}'), Client()
+            client.force_login(user)
+            clients.append((user, client))
+
+        start = time.monotonic()
+        next_submission = start
+        submitted, rejected = {}, 0
+        for index in range(options['jobs']):
+            time.sleep(max(next_submission - time.monotonic(), 0))
+            next_submission += rng.expovariate(options['rate'])
+
+            user, client = rng.choice(clients)
+            # no content hash, so every pipeline runs instead of hitting the result cache
+            data = Data.objects.create(user=user, data_type=rng.choice(data_types), name=f'benchmark-{index}',
+                                       data_file='data/benchmark.mp4')
+            response = client.post('/api/pipeline/run/', {
+                'data': data.id,
+                'nerf': rng.choice(nerfs).id,
+                'export_method': rng.choice(export_methods).id,
+            }, content_type='application/json')
+            if response.status_code == 201:
+                submitted[response.json()['nerf_object']] = timezone.now()
+            else:
+                rejected += 1
+        submit_time = time.monotonic() - start
+
+        deadline = time.monotonic() + options['timeout']
+        while time.monotonic() < deadline:
+            if not NerfObject.objects.filter(id__in=submitted, status='in_progress').exists():
+                break
+            time.sleep(0.5)
+        wall_time = time.monotonic() - start
+
+        return self.build_report(options, concurrency, times, submitted, rejected, submit_time, wall_time)
+
+    def build_report(self, options, concurrency, times, submitted, rejected, submit_time, wall_time) -> dict:
+        objects = NerfObject.objects.filter(id__in=submitted)
+        statuses = {}
+        latencies = []
+        for nerf_object in objects:
+            statuses[nerf_object.status] = statuses.get(nerf_object.status, 0) + 1
+            if nerf_object.status == 'complete':
+                latencies.append((nerf_object.end_date - submitted[nerf_object.id]).total_seconds())
+
+        stages = {}
+        for queue, threads in concurrency.items():
+            tasks = [task for task in times.tasks.values() if task.get('queue') == queue and 'finished' in task]
+            waits = [task['started'] - task['published'] for task in tasks if 'published' in task]
+            runs = [task['finished'] - task['started'] for task in tasks]
+            stages[queue] = {
+                'concurrency': threads,
+                'tasks': len(tasks),
+                'queue_wait': percentiles(waits),
+                'run_time': percentiles(runs),
+                'utilization': round(sum(runs) / (threads * wall_time), 3) if wall_time else None,
+            }
+
+        return {
+            'jobs': options['jobs'],
+            'accepted': len(submitted),
+            'rejected': rejected,
+            'target_rate': options['rate'],
+            'submission_rate': round(options['jobs'] / submit_time, 3) if submit_time else None,
+            'time_scale': options['time_scale'],
+            'wall_time': round(wall_time, 3),
+            'statuses': statuses,
+            'throughput_per_minute': round(60 * statuses.get('complete', 0) / wall_time, 3),
+            'end_to_end_latency': percentiles(latencies),
+            'stages': stages,
+        }
+
+    def write_report(self, report: dict) -> None:
+        self.stdout.write(f"Pipelines: {report['accepted']} accepted, {report['rejected']} rejected, "
+                          f"submitted at {report['submission_rate']}/s (target {report['target_rate']}/s)")
+        self.stdout.write(f"Wall time: {report['wall_time']} s, outcomes: {report['statuses']}, "
+                          f"throughput: {report['throughput_per_minute']} pipelines/min")
+        latency = report['end_to_end_latency']
+        self.stdout.write(f"End-to-end latency (s): p50 {latency['p50']}  p90 {latency['p90']}  p99 {latency['p99']}")
+        self.stdout.write('')
+        self.stdout.write(f"{'queue':<16}{'workers':>8}{'tasks':>8}{'wait p50':>10}{'wait p90':>10}{'wait p99':>10}"
+                          f"{'run p50':>10}{'run p99':>10}{'util':>8}")
+        for queue, stage in report['stages'].items():
+            wait, run = stage['queue_wait'], stage['run_time']
+            self.stdout.write(f"{queue:<16}{stage['concurrency']:>8}{stage['tasks']:>8}"
+                              f"{str(wait['p50']):>10}{str(wait['p90']):>10}{str(wait['p99']):>10}"
+                              f"{str(run['p50']):>10}{str(run['p99']):>10}{str(stage['utilization']):>8}")
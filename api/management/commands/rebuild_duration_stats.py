@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.models import DurationStats, ProcessedData, NerfModel, NerfObject
+from api.predictions import STAGE_MODELS, run_sample, stats_increments
+
+# what job_parameters reads, so the rebuild does not query per job
+RELATED_FIELDS = {
+    ProcessedData: ['data__data_type'],
+    NerfModel: ['nerf', 'processed_data'],
+    NerfObject: ['export_method', 'nerf_model__processed_data'],
+}
+
+class Command(BaseCommand):
+    help = ('Recomputes the run time stats behind the ETA predictions from every completed job, '
+            'e.g. for jobs that ran before they were kept. Tasks keep them up to date afterwards.')
+
+    def handle(self, *args, **options):
+        stats = {}
+        for model in STAGE_MODELS.values():
+            jobs = (model.objects
+                    .filter(status='complete', started_at__isnull=False, finished_at__isnull=False)
+                    .select_related(*RELATED_FIELDS[model]))
+            for job in jobs.iterator():
+                stage, name, size, run_time = run_sample(job)
+                for key in (name, ''):
+                    row = stats.setdefault((stage, key), DurationStats(stage=stage, name=key))
+                    for field, value in stats_increments(size, run_time).items():
+                        setattr(row, field, getattr(row, field) + value)
+
+        with transaction.atomic():
+            DurationStats.objects.all().delete()
+            DurationStats.objects.bulk_create(stats.values())
+
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {len(stats)} duration stats.'))
@@ -0,0 +1,398 @@
+import json
+import struct
+
+import numpy as np
+
+GLB_MAGIC = 0x46546C67
+GLB_VERSION = 2
+GLB_CHUNK_JSON = 0x4E4F534A
+GLB_CHUNK_BIN = 0x004E4942
+
+GLTF_UNSIGNED_SHORT = 5123
+GLTF_UNSIGNED_INT = 5125
+GLTF_FLOAT = 5126
+GLTF_ARRAY_BUFFER = 34962
+GLTF_ELEMENT_ARRAY_BUFFER = 34963
+
+def select_lines(raw: np.ndarray, starts: np.ndarray, ends: np.ndarray, prefix_length: int) -> bytes:
+    """ Concatenates the given lines, without their keyword prefix, using a vectorized mask. """
+    # lines never overlap, so the running sum of +1/-1 marks is 1 exactly inside them;
+    # each line keeps its trailing newline as the separator from the next one
+    marks = np.zeros(len(raw) + 2, dtype=np.int8)
+    marks[np.minimum(starts + prefix_length, ends)] += 1
+    marks[ends + 1] -= 1
+    mask = np.cumsum(marks[:len(raw)], dtype=np.int8).astype(bool)
+    return raw[mask].tobytes()
+
+def parse_numbers(text: bytes, count: int, dtype) -> np.ndarray:
+    """ Parses whitespace separated numbers into a `count` rows array. """
+    if count == 0:
+        return np.zeros((0, 0), dtype=dtype)
+    values = np.fromstring(text, dtype=dtype, sep=' ')
+    if values.size % count:
+        raise ValueError('OBJ lines of the same kind have a different number of values')
+    return values.reshape(count, -1)
+
+def classify_lines(raw: np.ndarray):
+    """ Finds the non-empty lines of an OBJ buffer and masks them by keyword. """
+    newlines = np.flatnonzero(raw == ord('\n'))
+    starts = np.concatenate(([0], newlines + 1))
+    ends = np.concatenate((newlines, [raw.size]))
+    keep = starts < ends
+    starts, ends = starts[keep], ends[keep]
+
+    last = raw.size - 1
+    first = raw[starts]
+    second = raw[np.minimum(starts + 1, last)]
+    third = raw[np.minimum(starts + 2, last)]
+    is_space = lambda byte: (byte == ord(' ')) | (byte == ord('\t'))
+
+    kinds = {
+        'v': (first == ord('v')) & is_space(second),
+        'vt': (first == ord('v')) & (second == ord('t')) & is_space(third),
+        'vn': (first == ord('v')) & (second == ord('n')) & is_space(third),
+        'f': (first == ord('f')) & is_space(second),
+        'material': (first == ord('m')) | (first == ord('u')),
+    }
+    return starts, ends, kinds
+
+def mesh_statistics(file_path: str, chunk_size: int = 64 * 1024 * 1024) -> dict:
+    """
+    Counts vertices and faces and measures the bounding box of an OBJ in one pass.
+
+    The file is memory-mapped and walked in newline-aligned chunks, so memory use
+    is bounded by the chunk size whatever the size of the mesh.
+    """
+    raw = np.memmap(file_path, dtype=np.uint8, mode='r')
+    vertex_count = 0
+    face_count = 0
+    low = np.full(3, np.inf)
+    high = np.full(3, -np.inf)
+
+    offset = 0
+    while offset < raw.size:
+        end = min(offset + chunk_size, raw.size)
+        # extend the chunk to the end of its last line
+        while end < raw.size and raw[end - 1] != ord('\n'):
+            newlines = np.flatnonzero(raw[end:end + 4096] == ord('\n'))
+            end = end + int(newlines[0]) + 1 if newlines.size else min(end + 4096, raw.size)
+
+        chunk = raw[offset:end]
+        starts, ends, kinds = classify_lines(chunk)
+        chunk_vertices = int(kinds['v'].sum())
+        if chunk_vertices:
+            positions = parse_numbers(select_lines(chunk, starts[kinds['v']], ends[kinds['v']], 2),
+                                      chunk_vertices, np.float64)[:, :3]
+            low = np.minimum(low, positions.min(axis=0))
+            high = np.maximum(high, positions.max(axis=0))
+        vertex_count += chunk_vertices
+        face_count += int(kinds['f'].sum())
+        offset = end
+
+    return {
+        'vertex_count': vertex_count,
+        'face_count': face_count,
+        'bounding_box': {'min': low.tolist(), 'max': high.tolist()} if vertex_count else None,
+    }
+
+def load_obj(file_path: str) -> dict:
+    """
+    Parses a triangulated OBJ into NumPy arrays without iterating over its lines in Python.
+
+    The file is memory-mapped, lines are classified by their keyword with array
+    operations, and the numbers of each kind are handed to NumPy's C parser in a
+    single call. Returns positions, uvs, normals and the (faces, corners, 3)
+    array of 0-based v/vt/vn indices (-1 when a face has no uv or normal).
+    """
+    raw = np.memmap(file_path, dtype=np.uint8, mode='r')
+    if raw.size == 0:
+        raise ValueError('Empty OBJ file')
+
+    starts, ends, kinds = classify_lines(raw)
+    vertex_lines, uv_lines = kinds['v'], kinds['vt']
+    normal_lines, face_lines = kinds['vn'], kinds['f']
+    material_lines = kinds['material']
+
+    positions = parse_numbers(select_lines(raw, starts[vertex_lines], ends[vertex_lines], 2),
+                              int(vertex_lines.sum()), np.float32)[:, :3]
+    uvs = parse_numbers(select_lines(raw, starts[uv_lines], ends[uv_lines], 3),
+                        int(uv_lines.sum()), np.float32)[:, :2]
+    normals = parse_numbers(select_lines(raw, starts[normal_lines], ends[normal_lines], 3),
+                            int(normal_lines.sum()), np.float32)[:, :3]
+
+    face_text = select_lines(raw, starts[face_lines], ends[face_lines], 2)
+    face_count = int(face_lines.sum())
+    if face_count == 0:
+        raise ValueError('OBJ file has no faces')
+
+    # 'v', 'v/vt', 'v//vn' and 'v/vt/vn' corners, told apart by the slashes of the first face
+    first_face = face_text.split(b'\n', 1)[0].split()
+    slashes = first_face[0].count(b'/')
+    has_uv = slashes >= 1 and b'//' not in first_face[0]
+    has_normal = slashes == 2
+    if len(first_face) != 3:
+        raise ValueError('Only triangulated OBJ files are supported')
+
+    indices = parse_numbers(face_text.replace(b'/', b' '), face_count, np.int64)
+    per_corner = 1 + has_uv + has_normal
+    if indices.shape[1] != 3 * per_corner:
+        raise ValueError('Only triangulated OBJ files with uniform faces are supported')
+    indices = indices.reshape(face_count, 3, per_corner)
+
+    corners = np.full((face_count, 3, 3), -1, dtype=np.int64)
+    sizes = (len(positions), len(uvs), len(normals))
+    columns = [0] + ([1] if has_uv else []) + ([2] if has_normal else [])
+    for source, target in enumerate(columns):
+        values = indices[:, :, source]
+        # OBJ indices are 1-based, negative ones count back from the end
+        corners[:, :, target] = np.where(values < 0, values + sizes[target], values - 1)
+
+    # mtllib/usemtl statements are a handful of lines, kept verbatim for re-export
+    material_statements = [bytes(raw[start:end]).decode('utf-8').strip()
+                           for start, end in zip(starts[material_lines], ends[material_lines])]
+
+    return {
+        'positions': positions,
+        'uvs': uvs,
+        'normals': normals,
+        'faces': corners,
+        'materials': [statement for statement in material_statements
+                      if statement.startswith(('mtllib ', 'usemtl '))],
+    }
+
+def cluster_points(points: np.ndarray, resolution: int) -> np.ndarray:
+    """ Assigns each point the id of the cell it falls in, on a `resolution` wide grid over its bounds. """
+    low = points.min(axis=0)
+    extent = max(float((points.max(axis=0) - low).max()), 1e-12)
+    cells = np.minimum(np.floor((points - low) / extent * resolution).astype(np.int64), resolution - 1)
+
+    keys = np.zeros(len(points), dtype=np.int64)
+    for axis in range(points.shape[1]):
+        keys = keys * resolution + cells[:, axis]
+    return np.unique(keys, return_inverse=True)[1].reshape(-1)
+
+def cluster_means(values: np.ndarray, clusters: np.ndarray, count: int) -> np.ndarray:
+    """ Averages the rows of `values` that share a cluster id. """
+    sizes = np.maximum(np.bincount(clusters, minlength=count), 1)
+    return np.stack([np.bincount(clusters, weights=values[:, axis], minlength=count) / sizes
+                     for axis in range(values.shape[1])], axis=1).astype(np.float32)
+
+def decimate_mesh(mesh: dict, ratio: float) -> dict:
+    """
+    Reduces a mesh loaded by `load_obj` to about `ratio` of its faces by vertex clustering.
+
+    Vertices are snapped to a uniform grid and merged per cell, and faces that
+    collapse are dropped. The grid resolution is binary searched for the finest
+    one that keeps at most the target face count, but at least one face: when no
+    grid does both (e.g. a tiny mesh at a low ratio), the one keeping the fewest
+    faces is used. UVs are clustered separately in texture space so texture seams
+    are preserved, and normals are averaged.
+    """
+    if ratio >= 1 or not len(mesh['faces']):
+        return mesh
+
+    faces = mesh['faces']
+    positions = mesh['positions']
+    target = max(int(len(faces) * ratio), 1)
+
+    best, fewest = None, None
+    low, high = 1, 2 ** 20
+    while low <= high:
+        resolution = (low + high) // 2
+        clusters = cluster_points(positions, resolution)
+        corners = clusters[faces[:, :, 0]]
+        keep = ((corners[:, 0] != corners[:, 1]) &
+                (corners[:, 1] != corners[:, 2]) &
+                (corners[:, 0] != corners[:, 2]))
+        kept = keep.sum()
+        if kept <= target:
+            if kept:
+                best = (resolution, clusters, keep)
+            low = resolution + 1
+        else:
+            if fewest is None or kept < fewest[2].sum():
+                fewest = (resolution, clusters, keep)
+            high = resolution - 1
+
+    # only a mesh of degenerate faces has neither, and it cannot get any smaller
+    if best is None and fewest is None:
+        return mesh
+    resolution, clusters, keep = best or fewest
+    kept_faces = faces[keep]
+    used_positions, position_index = np.unique(clusters[kept_faces[:, :, 0]], return_inverse=True)
+    position_index = position_index.reshape(-1, 3)
+
+    # vertices whose cell no longer belongs to any face are dropped
+    remap = np.full(clusters.max() + 1, -1, dtype=np.int64)
+    remap[used_positions] = np.arange(len(used_positions))
+    vertex_index = remap[clusters]
+    valid = vertex_index >= 0
+    new_positions = cluster_means(positions[valid], vertex_index[valid], len(used_positions))
+
+    new_faces = np.full((len(kept_faces), 3, 3), -1, dtype=np.int64)
+    new_faces[:, :, 0] = position_index
+
+    new_uvs = np.zeros((0, 2), dtype=np.float32)
+    if len(kept_faces) and (kept_faces[:, :, 1] >= 0).all() and len(mesh['uvs']):
+        uv_clusters = cluster_points(mesh['uvs'], resolution)
+        used_uvs, uv_index = np.unique(uv_clusters[kept_faces[:, :, 1]], return_inverse=True)
+        uv_remap = np.full(uv_clusters.max() + 1, -1, dtype=np.int64)
+        uv_remap[used_uvs] = np.arange(len(used_uvs))
+        uv_vertex_index = uv_remap[uv_clusters]
+        valid = uv_vertex_index >= 0
+        new_uvs = cluster_means(mesh['uvs'][valid], uv_vertex_index[valid], len(used_uvs))
+        new_faces[:, :, 1] = uv_index.reshape(-1, 3)
+
+    new_normals = np.zeros((0, 3), dtype=np.float32)
+    if len(kept_faces) and (kept_faces[:, :, 2] >= 0).all() and len(mesh['normals']):
+        corner_normals = mesh['normals'][kept_faces[:, :, 2].reshape(-1)]
+        new_normals = cluster_means(corner_normals, position_index.reshape(-1), len(used_positions))
+        lengths = np.linalg.norm(new_normals, axis=1, keepdims=True)
+        new_normals = new_normals / np.maximum(lengths, 1e-12)
+        new_faces[:, :, 2] = position_index
+
+    return {
+        'positions': new_positions,
+        'uvs': new_uvs,
+        'normals': new_normals,
+        'faces': new_faces,
+        'materials': mesh.get('materials', []),
+    }
+
+def write_obj(mesh: dict, obj_path: str) -> None:
+    """ Writes a mesh loaded by `load_obj` (or decimated from one) back to an OBJ file. """
+    faces = mesh['faces']
+    has_uv = len(faces) and (faces[:, :, 1] >= 0).all()
+    has_normal = len(faces) and (faces[:, :, 2] >= 0).all()
+
+    if has_uv and has_normal:
+        face_format = 'f %d/%d/%d %d/%d/%d %d/%d/%d'
+        columns = [0, 1, 2]
+    elif has_uv:
+        face_format = 'f %d/%d %d/%d %d/%d'
+        columns = [0, 1]
+    elif has_normal:
+        face_format = 'f %d//%d %d//%d %d//%d'
+        columns = [0, 2]
+    else:
+        face_format = 'f %d %d %d'
+        columns = [0]
+
+    with open(obj_path, 'w') as obj:
+        mtllib = [statement for statement in mesh.get('materials', []) if statement.startswith('mtllib ')]
+        usemtl = [statement for statement in mesh.get('materials', []) if statement.startswith('usemtl ')]
+        for statement in mtllib[:1]:
+            obj.write(statement + '\n')
+
+        np.savetxt(obj, mesh['positions'], fmt='v %.6f %.6f %.6f')
+        if has_uv:
+            np.savetxt(obj, mesh['uvs'], fmt='vt %.6f %.6f')
+        if has_normal:
+            np.savetxt(obj, mesh['normals'], fmt='vn %.6f %.6f %.6f')
+
+        for statement in usemtl[:1]:
+            obj.write(statement + '\n')
+        np.savetxt(obj, (faces[:, :, columns] + 1).reshape(len(faces), -1), fmt=face_format)
+
+def pad_to_four(data: bytes, pad_byte: bytes = b'\x00') -> bytes:
+    return data + pad_byte * (-len(data) % 4)
+
+def build_glb(mesh: dict, texture_bytes: bytes = None) -> bytes:
+    """
+    Packs a mesh loaded by `load_obj` into a binary glTF.
+
+    OBJ corners index positions, uvs and normals separately, so every distinct
+    (v, vt, vn) triple becomes one glTF vertex. Indices are packed as uint16 when
+    they fit and uint32 otherwise, and the texture is embedded in the binary chunk.
+    """
+    corners = mesh['faces'].reshape(-1, 3)
+    unique_corners, inverse = np.unique(corners, axis=0, return_inverse=True)
+    inverse = inverse.reshape(-1)
+
+    index_type = np.uint16 if len(unique_corners) < 2 ** 16 else np.uint32
+    attributes = {
+        'POSITION': mesh['positions'][unique_corners[:, 0]].astype(np.float32),
+    }
+    if (unique_corners[:, 2] >= 0).all() and len(mesh['normals']):
+        attributes['NORMAL'] = mesh['normals'][unique_corners[:, 2]].astype(np.float32)
+    if (unique_corners[:, 1] >= 0).all() and len(mesh['uvs']):
+        uvs = mesh['uvs'][unique_corners[:, 1]].astype(np.float32)
+        # OBJ puts the uv origin at the bottom left, glTF at the top left
+        uvs[:, 1] = 1.0 - uvs[:, 1]
+        attributes['TEXCOORD_0'] = uvs
+
+    binary = bytearray()
+    buffer_views = []
+    accessors = []
+
+    def add_view(data: bytes, target: int = None) -> int:
+        offset = len(binary)
+        binary.extend(pad_to_four(data))
+        view = {'buffer': 0, 'byteOffset': offset, 'byteLength': len(data)}
+        if target:
+            view['target'] = target
+        buffer_views.append(view)
+        return len(buffer_views) - 1
+
+    indices = inverse.astype(index_type)
+    accessors.append({
+        'bufferView': add_view(indices.tobytes(), GLTF_ELEMENT_ARRAY_BUFFER),
+        'componentType': GLTF_UNSIGNED_SHORT if index_type is np.uint16 else GLTF_UNSIGNED_INT,
+        'count': int(indices.size),
+        'type': 'SCALAR',
+    })
+
+    primitive_attributes = {}
+    for name, values in attributes.items():
+        accessor = {
+            'bufferView': add_view(values.tobytes(), GLTF_ARRAY_BUFFER),
+            'componentType': GLTF_FLOAT,
+            'count': int(len(values)),
+            'type': f'VEC{values.shape[1]}',
+        }
+        if name == 'POSITION':
+            accessor['min'] = values.min(axis=0).tolist()
+            accessor['max'] = values.max(axis=0).tolist()
+        accessors.append(accessor)
+        primitive_attributes[name] = len(accessors) - 1
+
+    primitive = {'attributes': primitive_attributes, 'indices': 0, 'mode': 4}
+    gltf = {
+        'asset': {'version': '2.0', 'generator': 'nerfcfm-api'},
+        'scene': 0,
+        'scenes': [{'nodes': [0]}],
+        'nodes': [{'mesh': 0}],
+        'meshes': [{'primitives': [primitive]}],
+        'accessors': accessors,
+        'bufferViews': buffer_views,
+    }
+
+    if texture_bytes and 'TEXCOORD_0' in attributes:
+        gltf['images'] = [{'bufferView': add_view(texture_bytes), 'mimeType': 'image/png'}]
+        gltf['samplers'] = [{}]
+        gltf['textures'] = [{'source': 0, 'sampler': 0}]
+        gltf['materials'] = [{
+            'pbrMetallicRoughness': {
+                'baseColorTexture': {'index': 0},
+                'metallicFactor': 0.0,
+                'roughnessFactor': 1.0,
+            },
+        }]
+        primitive['material'] = 0
+
+    gltf['buffers'] = [{'byteLength': len(binary)}]
+
+    json_chunk = pad_to_four(json.dumps(gltf, separators=(',', ':')).encode('utf-8'), b' ')
+    binary_chunk = bytes(binary)
+    total_length = 12 + 8 + len(json_chunk) + 8 + len(binary_chunk)
+
+    return b''.join([
+        struct.pack('<III', GLB_MAGIC, GLB_VERSION, total_length),
+        struct.pack('<II', len(json_chunk), GLB_CHUNK_JSON), json_chunk,
+        struct.pack('<II', len(binary_chunk), GLB_CHUNK_BIN), binary_chunk,
+    ])
+
+def write_glb(mesh: dict, glb_path: str, texture_bytes: bytes = None) -> None:
+    """ Writes a mesh loaded by `load_obj` (and its texture) as a single GLB file. """
+    with open(glb_path, 'wb') as glb:
+        glb.write(build_glb(mesh, texture_bytes))
@@ -0,0 +1,122 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Count, DurationField, ExpressionWrapper, F, Q, Sum
+
+from nerfcfm.celery import app
+from .predictions import STAGE_MODELS, stage_backlog
+
+def format_labels(labels: dict) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in labels.items()) + '}'
+
+class MetricsWriter:
+    """ Builds a Prometheus text exposition, metric family by metric family. """
+
+    def __init__(self):
+        self.lines = []
+
+    def family(self, name: str, kind: str, help_text: str) -> None:
+        self.lines.append(f'# HELP {name} {help_text}')
+        self.lines.append(f'# TYPE {name} {kind}')
+
+    def sample(self, name: str, labels: dict, value) -> None:
+        self.lines.append(f'{name}{format_labels(labels)} {value}')
+
+    def histogram(self, name: str, labels: dict, buckets: [float], counts: [int], total: float, count: int) -> None:
+        """ `counts` are cumulative, one per bucket. """
+        for bucket, bucket_count in zip(buckets, counts):
+            self.sample(f'{name}_bucket', {**labels, 'le': bucket}, bucket_count)
+        self.sample(f'{name}_bucket', {**labels, 'le': '+Inf'}, count)
+        self.sample(f'{name}_sum', labels, total)
+        self.sample(f'{name}_count', labels, count)
+
+    def render(self) -> str:
+        return '\n'.join(self.lines) + '\n'
+
+def duration_histograms(model, start_field: str, end_field: str, buckets: [float], by_status: bool) -> [tuple]:
+    """
+    Cumulative bucket counts, sum and count of `end_field - start_field`, in one
+    query. Returns (labels, histogram) pairs, one per status when `by_status`.
+    """
+    duration = ExpressionWrapper(F(end_field) - F(start_field), output_field=DurationField())
+    bucket_counts = {
+        f'le_{index}': Count('id', filter=Q(**{f'{end_field}__lte': F(start_field) + timedelta(seconds=bucket)}))
+        for index, bucket in enumerate(buckets)
+    }
+    queryset = model.objects.filter(**{f'{start_field}__isnull': False, f'{end_field}__isnull': False})
+    aggregates = {'count': Count('id'), 'total': Sum(duration), **bucket_counts}
+    if by_status:
+        rows = queryset.values('status').annotate(**aggregates).order_by('status')
+    else:
+        rows = [queryset.aggregate(**aggregates)]
+
+    histograms = []
+    for row in rows:
+        if not row['count']:
+            continue
+        labels = {'status': row['status']} if by_status else {}
+        histograms.append((labels, {
+            'counts': [row[f'le_{index}'] for index in range(len(buckets))],
+            'total': row['total'].total_seconds() if row['total'] else 0,
+            'count': row['count'],
+        }))
+    return histograms
+
+def broker_queue_depths() -> dict:
+    """ Messages waiting in each stage queue of the broker, reserved ones excluded. """
+    depths = {}
+    with app.connection_for_read() as connection:
+        channel = connection.default_channel
+        for queue in app.conf.task_queues:
+            if queue.name in STAGE_MODELS:
+                # declared as the workers declare it, since a passive declare fails on an empty redis queue
+                depths[queue.name] = queue.bind(channel).queue_declare().message_count
+    return depths
+
+def render_metrics() -> str:
+    """ Current pipeline metrics in the Prometheus text format, computed from the job tables and the broker. """
+    writer = MetricsWriter()
+    buckets = settings.METRICS_LATENCY_BUCKETS
+
+    writer.family('nerfcfm_jobs', 'gauge', 'Pipeline jobs by stage and status.')
+    for stage, model in STAGE_MODELS.items():
+        for row in model.objects.values('status').annotate(count=Count('id')).order_by('status'):
+            writer.sample('nerfcfm_jobs', {'stage': stage, 'status': row['status']}, row['count'])
+
+    writer.family('nerfcfm_jobs_queued', 'gauge',
+                  'Jobs whose task has not started running yet, including those waiting on the previous stage.')
+    writer.family('nerfcfm_jobs_in_flight', 'gauge', 'Jobs whose command is running.')
+    in_progress = {stage: stage_backlog(stage) for stage in STAGE_MODELS}
+    for stage, counts in in_progress.items():
+        writer.sample('nerfcfm_jobs_queued', {'stage': stage}, counts['queued'])
+    for stage, counts in in_progress.items():
+        writer.sample('nerfcfm_jobs_in_flight', {'stage': stage}, counts['in_flight'])
+
+    # the broker may be down while the API is not, the rest is still worth scraping
+    try:
+        depths = broker_queue_depths()
+    except Exception as e:
+        print(f"[METRICS]: BROKER ERROR {e}")
+        depths = {}
+    writer.family('nerfcfm_queue_depth', 'gauge', 'Task messages waiting in each stage queue of the broker.')
+    for queue, depth in depths.items():
+        writer.sample('nerfcfm_queue_depth', {'queue': queue}, depth)
+
+    # only ended jobs are split by status, as a running job's status still changes
+    histograms = [
+        ('nerfcfm_job_queue_wait_seconds', 'queued_at', 'started_at', False,
+         'Time from a job being ready to run (task published, previous stage done) to its command starting.'),
+        ('nerfcfm_job_run_seconds', 'started_at', 'finished_at', True,
+         'Time from a job\'s command starting to the job ending.'),
+        ('nerfcfm_job_latency_seconds', 'queued_at', 'finished_at', True,
+         'Time from a job being ready to run (task published, previous stage done) to the job ending.'),
+    ]
+    for name, start_field, end_field, by_status, help_text in histograms:
+        writer.family(name, 'histogram', help_text)
+        for stage, model in STAGE_MODELS.items():
+            for labels, histogram in duration_histograms(model, start_field, end_field, buckets, by_status):
+                writer.histogram(name, {'stage': stage, **labels}, buckets, **histogram)
+
+    return writer.render()
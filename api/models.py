@@ -1,3 +1,5 @@
+import uuid
+
 from django.db import models
 from django.utils import timezone
 from django.contrib.auth.models import User
@@ -16,6 +18,7 @@ class Data(models.Model):
 
     data_file = models.FileField(upload_to='data/')
     data_type = models.ForeignKey(DataType, on_delete=models.CASCADE)
+    content_hash = models.CharField(max_length=64, blank=True, default='', db_index=True)
 
     name = models.CharField(max_length=255)
     description = models.TextField(default='')
@@ -24,6 +27,36 @@ class Data(models.Model):
     def __str__(self):
         return f"{self.id} | {self.data_type.name}"
 
+class DataUpload(models.Model):
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+
+    data_type = models.ForeignKey(DataType, on_delete=models.CASCADE)
+    name = models.CharField(max_length=255)
+    description = models.TextField(default='')
+    filename = models.CharField(max_length=255)
+
+    size = models.PositiveBigIntegerField()
+    offset = models.PositiveBigIntegerField(default=0)
+
+    STATUS_UPLOAD_CHOICES = [
+        ('in_progress', 'In Progress'),
+        ('complete', 'Complete'),
+        ('failed', 'Failed'),
+    ]
+    status = models.CharField(max_length=20, choices=STATUS_UPLOAD_CHOICES, default='in_progress')
+    data = models.ForeignKey(Data, on_delete=models.SET_NULL, null=True, blank=True)
+
+    start_date = models.DateTimeField(auto_now_add=True)
+    end_date = models.DateTimeField(null=True, blank=True)
+
+    @property
+    def part_name(self):
+        return f'data/{self.id}.part'
+
+    def __str__(self):
+        return f"{self.id} | {self.filename} {self.offset}/{self.size}"
+
 class ProcessedData(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     data = models.ForeignKey(Data, on_delete=models.CASCADE)
@@ -32,14 +65,29 @@ class ProcessedData(models.Model):
         ('in_progress', 'In Progress'),
         ('complete', 'Complete'),
         ('failed', 'Failed'),
+        ('cancelled', 'Cancelled'),
     ]
     status = models.CharField(max_length=255, choices=STATUS_DATA_CHOICES, default='in_progress')
     processed_data_file = models.FileField(upload_to='processed_data/')
+    frame_count = models.PositiveIntegerField(null=True, blank=True)
 
     start_date = models.DateTimeField(auto_now_add=True)
     end_date = models.DateTimeField(null=True, blank=True)
     processing_time = models.DurationField(null=True, blank=True)
 
+    # when the job was ready for a worker (task published, previous stage done), when it began running
+    # and when it ended, set by the task
+    queued_at = models.DateTimeField(null=True, blank=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    progress = models.FloatField(default=0)
+    progress_stage = models.CharField(max_length=50, blank=True, default='')
+    estimated_end_date = models.DateTimeField(null=True, blank=True)
+
+    cache_key = models.CharField(max_length=64, blank=True, default='', db_index=True)
+    cache_source = models.ForeignKey('self', on_delete=models.SET_NULL, null=True, blank=True, related_name='reused_by')
+
     def save(self, *args, **kwargs):
         if self.start_date and self.end_date:
             self.processing_time = self.end_date - self.start_date
@@ -47,8 +95,18 @@ class ProcessedData(models.Model):
 
     def save_endtime(self):
         self.end_date = timezone.now()
+        self.estimated_end_date = None
+        if self.started_at:
+            self.finished_at = self.end_date
+        if self.status == 'complete':
+            self.progress = 1
         self.save()
 
+    @property
+    def artifact_id(self):
+        """ Id of the row whose media directory holds the results, shared when they are reused. """
+        return self.cache_source_id or self.id
+
     def __str__(self):
         return f"{self.id} | {self.data.id} {self.data.data_type.name}"
 
@@ -69,15 +127,30 @@ class NerfModel(models.Model):
     model_file = models.FileField(upload_to='nerf_models/')
     nerf = models.ForeignKey(Nerf, on_delete=models.CASCADE)
     has_normals = models.BooleanField(default=False)
+    sweep = models.ForeignKey('Sweep', on_delete=models.SET_NULL, null=True, blank=True, related_name='nerf_models')
 
     start_date = models.DateTimeField(auto_now_add=True)
     end_date = models.DateTimeField(null=True, blank=True)
     training_time = models.DurationField(null=True, blank=True)
 
+    queued_at = models.DateTimeField(null=True, blank=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    # when the task got its fair-share turn (see api/fairshare.py)
+    turn_taken_at = models.DateTimeField(null=True, blank=True)
+
+    progress = models.FloatField(default=0)
+    progress_stage = models.CharField(max_length=50, blank=True, default='')
+    estimated_end_date = models.DateTimeField(null=True, blank=True)
+
+    cache_key = models.CharField(max_length=64, blank=True, default='', db_index=True)
+    cache_source = models.ForeignKey('self', on_delete=models.SET_NULL, null=True, blank=True, related_name='reused_by')
+
     STATUS_MODEL_CHOICES = [
         ('in_progress', 'In Progress'),
         ('complete', 'Complete'),
         ('failed', 'Failed'),
+        ('cancelled', 'Cancelled'),
     ]
     status = models.CharField(max_length=20, choices=STATUS_MODEL_CHOICES, default='in_progress')
 
@@ -88,8 +161,17 @@ class NerfModel(models.Model):
     
     def save_endtime(self):
         self.end_date = timezone.now()
+        self.estimated_end_date = None
+        if self.started_at:
+            self.finished_at = self.end_date
+        if self.status == 'complete':
+            self.progress = 1
         self.save()
 
+    @property
+    def artifact_id(self):
+        return self.cache_source_id or self.id
+
     def __str__(self):
         return f"{self.id} | {self.processed_data.id} {self.nerf.name}"
 
@@ -109,10 +191,26 @@ def upload_directory_obj(instance, filename):
 class NerfObject(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     nerf_model = models.ForeignKey(NerfModel, on_delete=models.CASCADE)
+    sweep = models.ForeignKey('Sweep', on_delete=models.SET_NULL, null=True, blank=True, related_name='nerf_objects')
     
     object_file = models.FileField(upload_to=upload_directory_obj)
     texture_file = models.FileField(upload_to=upload_directory_obj)
     material_file = models.FileField(upload_to=upload_directory_obj)
+    glb_file = models.FileField(upload_to=upload_directory_obj, blank=True)
+
+    object_hash = models.CharField(max_length=64, blank=True, default='')
+    texture_hash = models.CharField(max_length=64, blank=True, default='')
+    material_hash = models.CharField(max_length=64, blank=True, default='')
+    glb_hash = models.CharField(max_length=64, blank=True, default='')
+
+    vertex_count = models.PositiveIntegerField(null=True, blank=True)
+    face_count = models.PositiveIntegerField(null=True, blank=True)
+    bounding_box = models.JSONField(null=True, blank=True)
+    object_size = models.PositiveBigIntegerField(null=True, blank=True)
+    texture_size = models.PositiveBigIntegerField(null=True, blank=True)
+    material_size = models.PositiveBigIntegerField(null=True, blank=True)
+    texture_width = models.PositiveIntegerField(null=True, blank=True)
+    texture_height = models.PositiveIntegerField(null=True, blank=True)
     
     export_method = models.ForeignKey(ExportMethod, on_delete=models.CASCADE)
     
@@ -120,10 +218,23 @@ class NerfObject(models.Model):
     end_date = models.DateTimeField(null=True, blank=True)
     export_time = models.DurationField(null=True, blank=True)
 
+    queued_at = models.DateTimeField(null=True, blank=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    turn_taken_at = models.DateTimeField(null=True, blank=True)
+
+    progress = models.FloatField(default=0)
+    progress_stage = models.CharField(max_length=50, blank=True, default='')
+    estimated_end_date = models.DateTimeField(null=True, blank=True)
+
+    cache_key = models.CharField(max_length=64, blank=True, default='', db_index=True)
+    cache_source = models.ForeignKey('self', on_delete=models.SET_NULL, null=True, blank=True, related_name='reused_by')
+
     STATUS_OBJECT_CHOICES = [
         ('in_progress', 'In Progress'),
         ('complete', 'Complete'),
         ('failed', 'Failed'),
+        ('cancelled', 'Cancelled'),
     ]
     status = models.CharField(max_length=20, choices=STATUS_OBJECT_CHOICES, default='in_progress')
 
@@ -134,11 +245,138 @@ class NerfObject(models.Model):
     
     def save_endtime(self):
         self.end_date = timezone.now()
+        self.estimated_end_date = None
+        if self.started_at:
+            self.finished_at = self.end_date
+        if self.status == 'complete':
+            self.progress = 1
         self.save()
     
     def __str__(self):
         return f"{self.id} | {self.nerf_model.id} {self.nerf_model.processed_data.data.data_type.name} {self.nerf_model.nerf.name} {self.export_method.name}"
 
+class NerfObjectLod(models.Model):
+    nerf_object = models.ForeignKey(NerfObject, on_delete=models.CASCADE, related_name='lods')
+
+    level = models.PositiveIntegerField()
+    ratio = models.FloatField()
+    face_count = models.PositiveIntegerField(default=0)
+
+    object_file = models.FileField(upload_to=upload_directory_obj)
+    glb_file = models.FileField(upload_to=upload_directory_obj, blank=True)
+    object_hash = models.CharField(max_length=64, blank=True, default='')
+    glb_hash = models.CharField(max_length=64, blank=True, default='')
+
+    class Meta:
+        ordering = ['level']
+        unique_together = ['nerf_object', 'level']
+
+    def __str__(self):
+        return f"{self.id} | {self.nerf_object.id} LOD {self.level}"
+
+class NerfObjectTexture(models.Model):
+    nerf_object = models.ForeignKey(NerfObject, on_delete=models.CASCADE, related_name='textures')
+
+    TEXTURE_FORMAT_CHOICES = [
+        ('png', 'PNG'),
+        ('webp', 'WebP'),
+    ]
+    format = models.CharField(max_length=10, choices=TEXTURE_FORMAT_CHOICES)
+    size = models.PositiveIntegerField()
+    width = models.PositiveIntegerField(default=0)
+    height = models.PositiveIntegerField(default=0)
+
+    texture_file = models.FileField(upload_to=upload_directory_obj)
+    texture_hash = models.CharField(max_length=64, blank=True, default='')
+
+    class Meta:
+        ordering = ['size']
+        unique_together = ['nerf_object', 'format', 'size']
+
+    def __str__(self):
+        return f"{self.id} | {self.nerf_object.id} {self.format} {self.size}"
+
+### Sweeps
+
+class Sweep(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    processed_data = models.ForeignKey(ProcessedData, on_delete=models.CASCADE)
+
+    nerfs = models.ManyToManyField(Nerf)
+    export_methods = models.ManyToManyField(ExportMethod)
+
+    STATUS_SWEEP_CHOICES = [
+        ('in_progress', 'In Progress'),
+        ('complete', 'Complete'),
+        ('partial', 'Partially Complete'),
+        ('failed', 'Failed'),
+    ]
+    status = models.CharField(max_length=20, choices=STATUS_SWEEP_CHOICES, default='in_progress')
+
+    start_date = models.DateTimeField(auto_now_add=True)
+    end_date = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.id} | {self.processed_data.id} {self.nerfs.count()}x{self.export_methods.count()}"
+
+### Duration predictions
+
+class DurationStats(models.Model):
+    """
+    Running sums over the completed runs of a pipeline stage, for one parameter
+    value (DataType, Nerf or ExportMethod name) or for all of them (name '').
+    Run time is fitted linearly against input size (bytes of the upload for
+    process_data, frames for the other stages) over the runs whose size is known.
+    """
+    stage = models.CharField(max_length=50)
+    name = models.CharField(max_length=50, blank=True, default='')
+
+    count = models.PositiveIntegerField(default=0)
+    sum_time = models.FloatField(default=0)
+
+    sized_count = models.PositiveIntegerField(default=0)
+    sum_size = models.FloatField(default=0)
+    sum_size_sq = models.FloatField(default=0)
+    sum_sized_time = models.FloatField(default=0)
+    sum_size_time = models.FloatField(default=0)
+
+    class Meta:
+        unique_together = ['stage', 'name']
+
+    @property
+    def mean_time(self):
+        return self.sum_time / self.count if self.count else None
+
+    def predict(self, size=None):
+        """ Expected run time in seconds, from the size fit when it is usable, else the mean. """
+        if size is None or self.sized_count < 2:
+            return self.mean_time
+        mean_size = self.sum_size / self.sized_count
+        mean_time = self.sum_sized_time / self.sized_count
+        variance = self.sum_size_sq / self.sized_count - mean_size ** 2
+        if variance <= 1e-9 * max(mean_size ** 2, 1):
+            return self.mean_time
+        slope = (self.sum_size_time / self.sized_count - mean_size * mean_time) / variance
+        # never predict less than a tenth of the mean for sizes far outside the observed ones
+        return max(mean_time + slope * (size - mean_size), 0.1 * mean_time)
+
+    def __str__(self):
+        return f"{self.id} | {self.stage} {self.name or '*'} {self.count}"
+
+### Fair share
+
+class UserQuota(models.Model):
+    """ Per-user settings of the fair-share scheduling of GPU stages; blank caps use the defaults. """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='quota')
+
+    # share of the GPU time relative to other users, who weigh 1 by default
+    weight = models.FloatField(default=1)
+    max_running_trainings = models.PositiveIntegerField(null=True, blank=True)
+    max_running_exports = models.PositiveIntegerField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.id} | {self.user.username} x{self.weight}"
+
 ### Reviews
 
 class Review(models.Model):
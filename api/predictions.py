@@ -0,0 +1,167 @@
+import math
+from bisect import bisect_left
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Count, F, Q
+from django.utils import timezone
+
+from nerfcfm.celery import PROCESS_DATA_QUEUE, TRAIN_MODEL_QUEUE, EXPORT_OBJECT_QUEUE, QUEUE_CONCURRENCY
+from .models import DurationStats, ProcessedData, NerfModel, NerfObject
+
+# pipeline stage -> job model; stages are named after their queues
+STAGE_MODELS = {
+    PROCESS_DATA_QUEUE: ProcessedData,
+    TRAIN_MODEL_QUEUE: NerfModel,
+    EXPORT_OBJECT_QUEUE: NerfObject,
+}
+
+def job_stage(instance) -> str:
+    for stage, model in STAGE_MODELS.items():
+        if isinstance(instance, model):
+            return stage
+
+def job_upstream(instance):
+    """ The job of the previous stage that `instance` builds on, if any. """
+    if isinstance(instance, NerfModel):
+        return instance.processed_data
+    if isinstance(instance, NerfObject):
+        return instance.nerf_model
+    return None
+
+def job_parameters(instance):
+    """
+    The name a job's run time is broken down by (its DataType, Nerf or ExportMethod)
+    and its input size: bytes of the upload for processing, frames of the processed
+    data for training and export. The size is None when it is not known.
+    """
+    if isinstance(instance, ProcessedData):
+        try:
+            size = instance.data.data_file.size
+        except (OSError, ValueError):
+            size = None
+        return instance.data.data_type.name, size
+    if isinstance(instance, NerfModel):
+        return instance.nerf.name, instance.processed_data.frame_count
+    return instance.export_method.name, instance.nerf_model.processed_data.frame_count
+
+# job model -> relations its estimate reads (job_parameters of the job and of the
+# upstream jobs it waits for, and the job it joined), for the querysets serializing
+# estimates to select_related
+ESTIMATE_RELATED = {
+    ProcessedData: ['data__data_type', 'cache_source'],
+    NerfModel: ['nerf', 'processed_data__data__data_type', 'cache_source'],
+    NerfObject: ['export_method', 'nerf_model__nerf', 'nerf_model__processed_data__data__data_type', 'cache_source'],
+}
+
+def run_sample(instance):
+    """ (stage, name, size, run time in seconds) of a job that ran to completion, else None. """
+    if instance.status != 'complete' or not instance.started_at or not instance.finished_at:
+        return None
+    name, size = job_parameters(instance)
+    return job_stage(instance), name, size, (instance.finished_at - instance.started_at).total_seconds()
+
+def stats_increments(size, run_time: float) -> dict:
+    increments = {'count': 1, 'sum_time': run_time}
+    if size is not None:
+        increments.update(sized_count=1, sum_size=size, sum_size_sq=size * size,
+                          sum_sized_time=run_time, sum_size_time=size * run_time)
+    return increments
+
+def record_run(instance) -> None:
+    """
+    Adds a completed job to the stats of its stage, both for its name and overall,
+    with an in-place UPDATE of each row so concurrent workers never lose a run.
+    """
+    sample = run_sample(instance)
+    if sample is None:
+        return
+    stage, name, size, run_time = sample
+    increments = {field: F(field) + value for field, value in stats_increments(size, run_time).items()}
+    for key in (name, ''):
+        DurationStats.objects.get_or_create(stage=stage, name=key)
+        DurationStats.objects.filter(stage=stage, name=key).update(**increments)
+
+def cached(cache, key, compute):
+    """ `compute()`, kept in `cache` under `key` when a cache is given. """
+    if cache is None:
+        return compute()
+    if key not in cache:
+        cache[key] = compute()
+    return cache[key]
+
+def predict_run_time(stage: str, name: str = '', size=None, cache: dict = None) -> float:
+    """
+    Expected seconds a job of `stage` runs for, from the stats of its name, or of
+    the whole stage while the name has fewer than PREDICTION_MIN_SAMPLES runs, or
+    PREDICTION_DEFAULT_RUN_TIMES while the stage has none. With a `cache`, the
+    stats of the stage are read once for every job predicted with it.
+    """
+    stats = cached(cache, ('stats', stage),
+                   lambda: {row.name: row for row in DurationStats.objects.filter(stage=stage)})
+    for key in (name, ''):
+        if key in stats and stats[key].count >= settings.PREDICTION_MIN_SAMPLES:
+            return stats[key].predict(size)
+    return settings.PREDICTION_DEFAULT_RUN_TIMES[stage]
+
+def predict_job_run_time(instance, cache: dict = None) -> float:
+    name, size = job_parameters(instance)
+    return predict_run_time(job_stage(instance), name, size, cache)
+
+def stage_backlog(stage: str) -> dict:
+    """
+    Jobs of a stage waiting for their task to start (including those waiting on
+    the previous stage) and jobs running. Rows that joined a running job have no
+    task of their own and are left out.
+    """
+    return (STAGE_MODELS[stage].objects
+            .filter(status='in_progress', cache_source__isnull=True)
+            .aggregate(queued=Count('id', filter=Q(started_at__isnull=True)),
+                       in_flight=Count('id', filter=Q(started_at__isnull=False))))
+
+def stage_workers(stage: str, in_flight: int) -> int:
+    # more jobs running than one worker's concurrency means more workers are consuming the queue
+    return max(QUEUE_CONCURRENCY[stage], in_flight, 1)
+
+def drain_time(stage: str, jobs: int, in_flight: int) -> int:
+    """ Seconds the workers of a stage take to get through `jobs` queued jobs. """
+    return math.ceil(math.ceil(jobs / stage_workers(stage, in_flight)) * predict_run_time(stage))
+
+def queue_wait(instance, cache: dict = None) -> float:
+    """ Seconds before a queued job gets a worker, with the jobs queued before it running first. """
+    stage = job_stage(instance)
+    in_flight = cached(cache, ('backlog', stage), lambda: stage_backlog(stage))['in_flight']
+    queued = cached(cache, ('queued', stage),
+                    lambda: list(type(instance).objects
+                                 .filter(status='in_progress', cache_source__isnull=True, started_at__isnull=True)
+                                 .order_by('id')
+                                 .values_list('id', flat=True)))
+    ahead = bisect_left(queued, instance.id)
+    return (ahead + in_flight) // stage_workers(stage, in_flight) * predict_run_time(stage, cache=cache)
+
+def estimate_end_date(instance, cache: dict = None):
+    """
+    When a job in progress should end, None for any other job.
+
+    A running job ends its predicted run time after it started, or when its
+    progress extrapolates to once the command reports some. A queued job first
+    waits for a worker and for the job of the previous stage. The `cache` is
+    shared by the estimates of a request (see `predict_run_time`).
+    """
+    if instance.status != 'in_progress':
+        return None
+    if instance.cache_source_id:
+        return estimate_end_date(instance.cache_source, cache)
+
+    now = timezone.now()
+    run_time = timedelta(seconds=predict_job_run_time(instance, cache))
+    if instance.started_at:
+        if instance.estimated_end_date:
+            return instance.estimated_end_date
+        return max(instance.started_at + run_time, now)
+
+    start = now + timedelta(seconds=queue_wait(instance, cache))
+    upstream = job_upstream(instance)
+    if upstream is not None and upstream.status == 'in_progress':
+        start = max(start, estimate_end_date(upstream, cache))
+    return start + run_time
@@ -0,0 +1,210 @@
+import os
+import re
+import signal
+import subprocess
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+from .events import publish_job_event
+
+# ns-train prints a table row per logged step: "1500 (5.00%)   45.1 ms   22 m, 30 s ..."
+TRAIN_STEP_RE = re.compile(r'^\s*(\d+)\s+\((\d+(?:\.\d+)?)%\)')
+
+# ns-process-data reports the frame count, ffmpeg the frames written so far,
+# and COLMAP (with --verbose) the images / blocks it has gone through.
+VIDEO_FRAMES_RE = re.compile(r'(?:Number of frames in video|Starting with)\D*(\d+)', re.IGNORECASE)
+FFMPEG_FRAME_RE = re.compile(r'frame=\s*(\d+)')
+COLMAP_COUNTER_RE = re.compile(r'\[(\d+)/(\d+)')
+
+# ns-process-data phases, as (stage, line marker, share of the whole job at which it starts)
+PROCESS_DATA_STAGES = [
+    ('frames', 'converting video to images', 0.0),
+    ('feature_extraction', 'feature extractor', 0.1),
+    ('feature_matching', 'feature matcher', 0.35),
+    ('reconstruction', 'bundle adjustment', 0.6),
+    ('finalizing', 'refine', 0.95),
+]
+
+# progress bars of ns-export and other tools: "... 42%" or "42.0%"
+PERCENT_RE = re.compile(r'(\d+(?:\.\d+)?)%')
+
+def parse_train_line(line: str, state: dict):
+    """ Reads the step table of ns-train, returning (stage, fraction) or None. """
+    match = TRAIN_STEP_RE.match(line)
+    if not match:
+        return None
+    return 'training', float(match.group(2)) / 100
+
+def parse_process_data_line(line: str, state: dict):
+    """ Follows the phases of ns-process-data, returning (stage, fraction) or None. """
+    lowered = line.lower()
+    for index, (stage, marker, start) in enumerate(PROCESS_DATA_STAGES):
+        if marker in lowered:
+            state['stage'] = index
+            return stage, start
+
+    index = state.get('stage', 0)
+    stage, _, start = PROCESS_DATA_STAGES[index]
+    end = PROCESS_DATA_STAGES[index + 1][2] if index + 1 < len(PROCESS_DATA_STAGES) else 1.0
+
+    match = VIDEO_FRAMES_RE.search(line)
+    if match:
+        state['frames'] = int(match.group(1))
+        return None
+
+    done, total = None, None
+    match = FFMPEG_FRAME_RE.search(line)
+    if match and stage == 'frames' and state.get('frames'):
+        done, total = int(match.group(1)), state['frames']
+    match = COLMAP_COUNTER_RE.search(line)
+    if match and stage != 'frames':
+        done, total = int(match.group(1)), int(match.group(2))
+
+    if not total:
+        return None
+    return stage, start + (end - start) * min(done / total, 1.0)
+
+def parse_export_line(line: str, state: dict):
+    """ Picks up percentages printed by ns-export progress bars, returning (stage, fraction) or None. """
+    match = PERCENT_RE.search(line)
+    if not match:
+        return None
+    return 'exporting', min(float(match.group(1)) / 100, 1.0)
+
+class ProgressTracker:
+    """
+    Keeps the progress fields of a pipeline row up to date without a write per line.
+
+    Updates are kept in memory and written (and pushed to the job event
+    streams) at most once every PROGRESS_UPDATE_INTERVAL seconds, or right
+    away when the stage changes.
+    """
+
+    def __init__(self, instance, interval: float = None):
+        self.instance = instance
+        self.interval = settings.PROGRESS_UPDATE_INTERVAL if interval is None else interval
+        self.stage = instance.progress_stage
+        self.fraction = instance.progress
+        self.written_at = None
+        self.dirty = False
+
+    def update(self, stage: str, fraction: float) -> None:
+        stage_changed = stage != self.stage
+        # progress never goes backwards within a stage, e.g. when a bar restarts
+        if not stage_changed and fraction <= self.fraction:
+            return
+        self.stage, self.fraction, self.dirty = stage, fraction, True
+
+        if stage_changed or self.written_at is None or time.monotonic() - self.written_at >= self.interval:
+            self.flush()
+
+    def estimated_end_date(self):
+        """ Linear extrapolation of the time spent so far over the fraction done. """
+        if not 0 < self.fraction < 1:
+            return None
+        started = self.instance.started_at or self.instance.start_date
+        return started + (timezone.now() - started) / self.fraction
+
+    def flush(self) -> None:
+        if not self.dirty:
+            return
+        fields = {
+            'progress': self.fraction,
+            'progress_stage': self.stage,
+            'estimated_end_date': self.estimated_end_date(),
+        }
+        type(self.instance).objects.filter(id=self.instance.id).update(**fields)
+        for field, value in fields.items():
+            setattr(self.instance, field, value)
+        publish_job_event(self.instance)
+        self.written_at = time.monotonic()
+        self.dirty = False
+
+class JobCancelled(Exception):
+    pass
+
+class JobTimeout(Exception):
+    pass
+
+def terminate_process_group(process: subprocess.Popen) -> None:
+    """ Stops a command and everything it spawned, forcefully if it ignores SIGTERM. """
+    for sig in (signal.SIGTERM, signal.SIGKILL):
+        try:
+            os.killpg(process.pid, sig)
+        except ProcessLookupError:
+            return
+        try:
+            process.wait(settings.JOB_KILL_GRACE_PERIOD)
+            return
+        except subprocess.TimeoutExpired:
+            pass
+
+class JobWatchdog(threading.Thread):
+    """
+    Kills the process group of a job when it is cancelled or runs past its timeout.
+
+    The row is checked every JOB_CANCEL_POLL_INTERVAL seconds from a separate
+    thread, so a command that prints nothing for hours can still be stopped.
+    """
+
+    def __init__(self, process: subprocess.Popen, instance, timeout: float = None):
+        super().__init__(daemon=True)
+        self.process = process
+        self.instance = instance
+        self.timeout = timeout
+        self.reason = None
+        self.finished = threading.Event()
+
+    def run(self):
+        deadline = time.monotonic() + self.timeout if self.timeout else None
+        try:
+            while not self.finished.wait(settings.JOB_CANCEL_POLL_INTERVAL):
+                if deadline and time.monotonic() >= deadline:
+                    self.reason = 'timeout'
+                elif type(self.instance).objects.filter(id=self.instance.id, status='cancelled').exists():
+                    self.reason = 'cancelled'
+                else:
+                    continue
+                terminate_process_group(self.process)
+                return
+        finally:
+            connection.close()
+
+def run_with_progress(command, parser, tracker: ProgressTracker, timeout: float = None,
+                      env: dict = None, log_prefix: str = '') -> int:
+    """
+    Runs a command, echoing its output line by line and feeding it to `parser`
+    so `tracker` can follow the job. Returns the exit code.
+
+    `env` adds variables to the command's environment, and `log_prefix` tells
+    apart the output of commands that run side by side in one worker.
+
+    The command runs in its own process group, which is killed as a whole when
+    the job is cancelled (raising JobCancelled) or runs longer than `timeout`
+    seconds (raising JobTimeout).
+    """
+    state = {}
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                               text=True, bufsize=1, errors='replace', start_new_session=True,
+                               env={**os.environ, 'PYTHONUNBUFFERED': '1', **(env or {})})
+    watchdog = JobWatchdog(process, tracker.instance, timeout)
+    watchdog.start()
+    with process:
+        for line in process.stdout:
+            print(log_prefix + line, end='')
+            update = parser(line, state)
+            if update:
+                tracker.update(*update)
+    watchdog.finished.set()
+    watchdog.join()
+
+    if watchdog.reason == 'cancelled':
+        raise JobCancelled()
+    if watchdog.reason == 'timeout':
+        raise JobTimeout(f'Timed out after {timeout} seconds')
+    tracker.flush()
+    return process.returncode
@@ -0,0 +1,250 @@
+"""
+Stand-in for the nerfstudio commands, used when USE_TEST_SCRIPT is set.
+
+    python simulator.py process_data <id> --name video
+    python simulator.py train_model <id> --name nerfacto [--load-dir checkpoint_dir]
+    python simulator.py export_object <id> --name tsdf
+
+Each run samples a duration from the distribution configured for its stage and
+name (DataType, Nerf or ExportMethod), prints progress the way nerfstudio does,
+writes artifacts of configurable size under media/, and fails in one of the
+configured ways. SIMULATOR_CONFIG points to a JSON file merged over
+DEFAULT_CONFIG, SIMULATOR_TIME_SCALE multiplies every duration and
+SIMULATOR_SEED makes runs reproducible.
+"""
+import argparse
+import json
+import math
+import os
+import random
+import signal
+import sys
+import time
+
+# Distributions: {"distribution": "fixed", "value": v}, {"distribution": "uniform", "min": a, "max": b},
+# {"distribution": "lognormal", "median": m, "sigma": s} and {"distribution": "exponential", "mean": m}.
+DEFAULT_CONFIG = {
+    'time_scale': 1.0,
+    'stages': {
+        'process_data': {
+            'duration': {'distribution': 'lognormal', 'median': 300, 'sigma': 0.5},
+            'frames': {'distribution': 'uniform', 'min': 150, 'max': 600},
+            'failure_rate': 0.05,
+            'crash_rate': 0.0,
+            'hang_rate': 0.0,
+            'by_name': {
+                'images': {'duration': {'distribution': 'lognormal', 'median': 180, 'sigma': 0.5}},
+            },
+        },
+        'train_model': {
+            'duration': {'distribution': 'lognormal', 'median': 1800, 'sigma': 0.3},
+            'steps': 30000,
+            'steps_per_save': 2000,
+            'checkpoint_size': 1024 * 1024,
+            'failure_rate': 0.05,
+            'crash_rate': 0.0,
+            'hang_rate': 0.0,
+            'by_name': {
+                'instant-ngp': {'duration': {'distribution': 'lognormal', 'median': 600, 'sigma': 0.3}},
+                'splatfacto': {'duration': {'distribution': 'lognormal', 'median': 1200, 'sigma': 0.3}},
+            },
+        },
+        'export_object': {
+            'duration': {'distribution': 'lognormal', 'median': 120, 'sigma': 0.4},
+            'vertices': {'distribution': 'lognormal', 'median': 20000, 'sigma': 0.5},
+            'texture_size': 1024,
+            'failure_rate': 0.02,
+            'crash_rate': 0.0,
+            'hang_rate': 0.0,
+            'by_name': {
+                'pointcloud': {'duration': {'distribution': 'lognormal', 'median': 30, 'sigma': 0.4}},
+                'poisson': {'duration': {'distribution': 'lognormal', 'median': 240, 'sigma': 0.4}},
+            },
+        },
+    },
+}
+
+# ns-process-data phases and their share of the run
+PROCESS_DATA_PHASES = [
+    ('frames', 0.15),
+    ('feature extractor', 0.25),
+    ('feature matcher', 0.25),
+    ('bundle adjustment', 0.3),
+    ('refine', 0.05),
+]
+
+class Failure(Exception):
+    pass
+
+def merge(base: dict, override: dict) -> dict:
+    merged = dict(base)
+    for key, value in override.items():
+        merged[key] = merge(base[key], value) if isinstance(value, dict) and isinstance(base.get(key), dict) else value
+    return merged
+
+def load_config(stage: str, name: str) -> dict:
+    """ Settings of a stage, with the overrides of its name applied. """
+    config = DEFAULT_CONFIG
+    if os.getenv('SIMULATOR_CONFIG'):
+        with open(os.getenv('SIMULATOR_CONFIG')) as file:
+            config = merge(config, json.load(file))
+
+    stage_config = dict(config['stages'][stage])
+    stage_config = merge(stage_config, stage_config.pop('by_name', {}).get(name, {}))
+    stage_config['time_scale'] = float(os.getenv('SIMULATOR_TIME_SCALE', config['time_scale']))
+    return stage_config
+
+def sample(spec):
+    if not isinstance(spec, dict):
+        return spec
+    distribution = spec['distribution']
+    if distribution == 'fixed':
+        return spec['value']
+    if distribution == 'uniform':
+        return random.uniform(spec['min'], spec['max'])
+    if distribution == 'lognormal':
+        return random.lognormvariate(math.log(spec['median']), spec['sigma'])
+    if distribution == 'exponential':
+        return random.expovariate(1 / spec['mean'])
+    raise ValueError(f'Unknown distribution {distribution}')
+
+class Run:
+    """ Spreads a sampled duration over the progress steps of a run and injects its failure. """
+
+    def __init__(self, config: dict):
+        self.duration = sample(config['duration']) * config['time_scale']
+        self.failure = None
+        self.failure_at = random.random()
+        roll = random.random()
+        for mode in ('failure', 'crash', 'hang'):
+            rate = config[f'{mode}_rate']
+            if roll < rate:
+                self.failure = mode
+                break
+            roll -= rate
+        self.done = 0.0
+
+    def advance(self, share: float) -> None:
+        """ Sleeps for `share` of the run, then fails if the failure point was crossed. """
+        time.sleep(self.duration * share)
+        self.done += share
+        if self.failure and self.done >= self.failure_at:
+            if self.failure == 'crash':
+                # like the OOM killer, no output and no cleanup
+                os.kill(os.getpid(), signal.SIGKILL)
+            if self.failure == 'hang':
+                print("Waiting on CUDA device...", flush=True)
+                while True:
+                    time.sleep(60)
+            raise Failure(f"Simulated failure at {100 * self.done:.0f}%")
+
+def process_data(job_id: int, config: dict, run: Run, args) -> None:
+    output_dir = f'media/processed_data/{job_id}/'
+    os.makedirs(output_dir, exist_ok=True)
+    frames = int(sample(config['frames']))
+
+    print("Converting video to images...", flush=True)
+    print(f"Number of frames in video: {frames}", flush=True)
+    for phase, share in PROCESS_DATA_PHASES:
+        if phase != 'frames':
+            print(f"Running COLMAP {phase}...", flush=True)
+        for step in range(1, 11):
+            run.advance(share / 10)
+            if phase == 'frames':
+                print(f"frame= {frames * step // 10} fps=30.0", flush=True)
+            else:
+                print(f"Processed file [{step}/10]", flush=True)
+
+    transforms = {'frames': [{'file_path': f'images/frame_{frame:05d}.png'} for frame in range(1, frames + 1)]}
+    with open(os.path.join(output_dir, 'transforms.json'), 'w') as file:
+        json.dump(transforms, file)
+
+def train_model(job_id: int, config: dict, run: Run, args) -> None:
+    checkpoint_dir = f'media/nerf_models/{job_id}/{args.name}/{time.strftime("%Y-%m-%d_%H%M%S")}/nerfstudio_models/'
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    steps, steps_per_save = config['steps'], config['steps_per_save']
+
+    # resume like ns-train --load-dir, from the step of the newest checkpoint
+    start_step = 0
+    if args.load_dir:
+        checkpoints = sorted(os.listdir(args.load_dir))
+        start_step = int(checkpoints[-1][len('step-'):-len('.ckpt')])
+        print(f"Loading latest checkpoint from load_dir: step {start_step}", flush=True)
+        run.done = start_step / steps
+
+    print("Step (% Done)       Train Iter (time)    ETA (time)", flush=True)
+    for step in range(start_step + steps_per_save, steps + steps_per_save, steps_per_save):
+        step = min(step, steps)
+        run.advance(steps_per_save / steps)
+        print(f"{step} ({100 * step / steps:.2f}%)        {1000 * run.duration / steps:.3f} ms", flush=True)
+        with open(os.path.join(checkpoint_dir, f'step-{step:09d}.ckpt'), 'wb') as checkpoint:
+            checkpoint.truncate(config['checkpoint_size'])
+
+def write_sphere_obj(path: str, vertices: int) -> None:
+    """ UV sphere of about `vertices` vertices, textured with material_0. """
+    rings = max(int(math.sqrt(vertices / 2)), 3)
+    segments = 2 * rings
+    with open(path, 'w') as file:
+        file.write("mtllib material_0.mtl\nusemtl material_0\n")
+        for ring in range(rings + 1):
+            theta = math.pi * ring / rings
+            for segment in range(segments + 1):
+                phi = 2 * math.pi * segment / segments
+                file.write(f"v {math.sin(theta) * math.cos(phi):.5f} {math.cos(theta):.5f} "
+                           f"{math.sin(theta) * math.sin(phi):.5f}\n")
+                file.write(f"vt {segment / segments:.5f} {1 - ring / rings:.5f}\n")
+        for ring in range(rings):
+            for segment in range(segments):
+                a = ring * (segments + 1) + segment + 1
+                b, c, d = a + segments + 1, a + 1, a + segments + 2
+                file.write(f"f {a}/{a} {b}/{b} {c}/{c}\nf {c}/{c} {b}/{b} {d}/{d}\n")
+
+def export_object(job_id: int, config: dict, run: Run, args) -> None:
+    from PIL import Image
+
+    output_dir = f'media/nerf_objects/{job_id}/'
+    os.makedirs(output_dir, exist_ok=True)
+
+    for percent in range(0, 100, 10):
+        print(f"Exporting mesh {percent}%", flush=True)
+        run.advance(0.1)
+    print("Exporting mesh 100%", flush=True)
+
+    write_sphere_obj(os.path.join(output_dir, 'mesh.obj'), int(sample(config['vertices'])))
+    size = int(sample(config['texture_size']))
+    Image.new('RGB', (size, size), (random.randrange(256), random.randrange(256), random.randrange(256))) \
+        .save(os.path.join(output_dir, 'material_0.png'))
+    with open(os.path.join(output_dir, 'material_0.mtl'), 'w') as file:
+        file.write("newmtl material_0\nKa 1.0 1.0 1.0\nKd 1.0 1.0 1.0\nmap_Kd material_0.png\n")
+
+STAGES = {
+    'process_data': process_data,
+    'train_model': train_model,
+    'export_object': export_object,
+}
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulates the nerfstudio command of a pipeline stage.")
+    parser.add_argument('stage', choices=STAGES)
+    parser.add_argument('id', type=int, help="Id of the job, naming its media directory.")
+    parser.add_argument('--name', default='', help="DataType, Nerf or ExportMethod name of the job.")
+    parser.add_argument('--load-dir', help="Checkpoint directory to resume training from.")
+    args = parser.parse_args()
+
+    if os.getenv('SIMULATOR_SEED'):
+        random.seed(f"{os.getenv('SIMULATOR_SEED')}-{args.stage}-{args.id}")
+
+    config = load_config(args.stage, args.name)
+    run = Run(config)
+    print(f"[SIMULATOR] {args.stage} {args.name} {run.duration:.1f} seconds", flush=True)
+
+    try:
+        STAGES[args.stage](args.id, config, run, args)
+    except Failure as e:
+        print(e, flush=True)
+        sys.exit(1)
+    except KeyboardInterrupt:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,8 @@
 from rest_framework import serializers
 
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.urls import reverse
 
 # USERS
 
@@ -14,15 +16,24 @@ class UserLoginSerializer(serializers.Serializer):
     username = serializers.CharField()
     password = serializers.CharField(style={'input_type': 'password'})
 
-from .models import Data
+from .models import Data, DataUpload
 
 # VIDEOS
 
 class DataUploadSerializer(serializers.ModelSerializer):
     class Meta:
         model = Data
-        fields = ['id', 'user', 'data_file', 'name', 'upload_date']
-        read_only_fields = ['id', 'user', 'upload_date']
+        fields = ['id', 'user', 'data_file', 'data_type', 'name', 'description', 'content_hash', 'upload_date']
+        read_only_fields = ['id', 'user', 'content_hash', 'upload_date']
+
+class DataUploadSessionSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = DataUpload
+        fields = ['id', 'user', 'data_type', 'name', 'description', 'filename', 'size', 'offset', 'status', 'data', 'start_date', 'end_date']
+        read_only_fields = ['id', 'user', 'offset', 'status', 'data', 'start_date', 'end_date']
+
+class DataUploadCompleteSerializer(serializers.Serializer):
+    sha256 = serializers.RegexField(r'^[0-9a-fA-F]{64}$')
 
 class DataListSerializer(serializers.ModelSerializer):
     class Meta:
@@ -43,6 +54,28 @@ class DataTypeSerializer(serializers.ModelSerializer):
         model = DataType
         fields = '__all__'
 
+# JOB ESTIMATES
+from .predictions import estimate_end_date, predict_job_run_time
+
+class JobEstimateSerializer(serializers.Serializer):
+    """
+    Predicted run time and end date of a job in progress, added to the job detail serializers.
+    The stats they are computed from are cached in the context, which every object of a list shares.
+    """
+    predicted_run_time = serializers.SerializerMethodField()
+    eta = serializers.SerializerMethodField()
+
+    def prediction_cache(self) -> dict:
+        return self.context.setdefault('predictions', {})
+
+    def get_predicted_run_time(self, obj):
+        if obj.status != 'in_progress':
+            return None
+        return round(predict_job_run_time(obj, self.prediction_cache()))
+
+    def get_eta(self, obj):
+        return estimate_end_date(obj, self.prediction_cache())
+
 from .models import ProcessedData
 
 # DATA
@@ -58,7 +91,7 @@ class UserProcessedDataSerializer(serializers.ModelSerializer):
         model = ProcessedData
         fields = '__all__'
 
-class ProcessedDataSerializer(serializers.ModelSerializer):
+class ProcessedDataSerializer(JobEstimateSerializer, serializers.ModelSerializer):
     class Meta:
         model = ProcessedData
         fields = '__all__'
@@ -83,7 +116,7 @@ class GenerateNerfModelSerializer(serializers.ModelSerializer):
         fields = ['nerf', 'processed_data', 'user']
         read_only_fields = ['user']
 
-class NerfModelSerializer(serializers.ModelSerializer):
+class NerfModelSerializer(JobEstimateSerializer, serializers.ModelSerializer):
     class Meta:
         model = NerfModel
         fields = '__all__'
@@ -102,7 +135,12 @@ class ExportMethodSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 # OBJECTS
-from .models import NerfObject
+from .models import NerfObject, NerfObjectLod
+
+class NerfObjectLodSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = NerfObjectLod
+        fields = ['level', 'ratio', 'face_count', 'object_file', 'glb_file']
 
 class GenerateNerfObjectSerializer(serializers.ModelSerializer):
     class Meta:
@@ -111,10 +149,135 @@ class GenerateNerfObjectSerializer(serializers.ModelSerializer):
         read_only_fields = ['user']
 
 class NerfObjectSerializer(serializers.ModelSerializer):
+    lods = NerfObjectLodSerializer(many=True, read_only=True)
+    thumbnail_url = serializers.SerializerMethodField()
+
     class Meta:
         model = NerfObject
         fields = '__all__'
 
+    def get_thumbnail_url(self, obj):
+        if not obj.texture_file:
+            return None
+        url = reverse('texture-nerf-objects', kwargs={'nerf_object_id': obj.id})
+        url = f'{url}?size={settings.NERF_OBJECT_THUMBNAIL_SIZE}&type=webp'
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request else url
+
+class NerfObjectDetailSerializer(JobEstimateSerializer, NerfObjectSerializer):
+    pass
+
+# PIPELINE
+
+class RunPipelineSerializer(serializers.Serializer):
+    data = serializers.PrimaryKeyRelatedField(queryset=Data.objects.all())
+    nerf = serializers.PrimaryKeyRelatedField(queryset=Nerf.objects.all())
+    export_method = serializers.PrimaryKeyRelatedField(queryset=ExportMethod.objects.all())
+
+# SWEEPS
+from .models import Sweep
+
+class RunSweepSerializer(serializers.Serializer):
+    processed_data = serializers.PrimaryKeyRelatedField(queryset=ProcessedData.objects.all())
+    nerfs = serializers.PrimaryKeyRelatedField(queryset=Nerf.objects.all(), many=True, allow_empty=False)
+    export_methods = serializers.PrimaryKeyRelatedField(queryset=ExportMethod.objects.all(), many=True, allow_empty=False)
+
+class SweepNerfObjectSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = NerfObject
+        fields = ['id', 'export_method', 'status', 'export_time']
+
+class SweepNerfModelSerializer(serializers.ModelSerializer):
+    nerf_objects = SweepNerfObjectSerializer(source='nerfobject_set', many=True, read_only=True)
+
+    class Meta:
+        model = NerfModel
+        fields = ['id', 'nerf', 'status', 'training_time', 'nerf_objects']
+
+class SweepSerializer(serializers.ModelSerializer):
+    progress = serializers.SerializerMethodField()
+    nerf_models = SweepNerfModelSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = Sweep
+        fields = ['id', 'user', 'processed_data', 'nerfs', 'export_methods', 'status',
+                  'start_date', 'end_date', 'progress', 'nerf_models']
+
+    def get_progress(self, obj):
+        """ Job counts per stage and status, e.g. {'nerf_models': {'complete': 2, 'in_progress': 1}}. """
+        progress = {}
+        for stage, jobs in (('nerf_models', obj.nerf_models.all()), ('nerf_objects', obj.nerf_objects.all())):
+            counts = {}
+            for job in jobs:
+                counts[job.status] = counts.get(job.status, 0) + 1
+            progress[stage] = counts
+        return progress
+
+# BATCH GENERATION
+
+class BatchGenerateSerializer(serializers.Serializer):
+    """
+    A list of generate requests, e.g. {"jobs": [{"data": 1}, {"data": 2}]}.
+
+    Related ids are resolved with one query per field for the whole list, not one per job.
+    """
+    # job field -> queryset its ids are looked up in
+    job_fields = {}
+
+    jobs = serializers.ListField(child=serializers.DictField(), allow_empty=False,
+                                 max_length=settings.BATCH_GENERATE_MAX_SIZE)
+
+    @staticmethod
+    def job_pk(value):
+        if isinstance(value, bool):
+            return None
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return None
+
+    def validate_jobs(self, jobs):
+        found = {}
+        for field, queryset in self.job_fields.items():
+            found[field] = queryset.in_bulk({self.job_pk(job.get(field)) for job in jobs} - {None})
+
+        validated, errors = [], []
+        for job in jobs:
+            job_errors, related = {}, {}
+            for field in self.job_fields:
+                related[field] = found[field].get(self.job_pk(job.get(field)))
+                if field not in job:
+                    job_errors[field] = ['This field is required.']
+                elif related[field] is None:
+                    job_errors[field] = [f'Invalid pk "{job[field]}" - object does not exist.']
+            errors.append(job_errors)
+            validated.append(related)
+
+        if any(errors):
+            raise serializers.ValidationError(errors)
+        return validated
+
+class BatchGenerateProcessedDataSerializer(BatchGenerateSerializer):
+    job_fields = {'data': Data.objects.select_related('data_type')}
+
+class BatchGenerateNerfModelSerializer(BatchGenerateSerializer):
+    job_fields = {'processed_data': ProcessedData.objects.all(), 'nerf': Nerf.objects.all()}
+
+class BatchGenerateNerfObjectSerializer(BatchGenerateSerializer):
+    job_fields = {'nerf_model': NerfModel.objects.all(), 'export_method': ExportMethod.objects.all()}
+
+# JOB PROGRESS
+
+class JobProgressSerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    status = serializers.CharField()
+    progress = serializers.FloatField()
+    progress_stage = serializers.CharField()
+    start_date = serializers.DateTimeField()
+    queued_at = serializers.DateTimeField()
+    started_at = serializers.DateTimeField()
+    estimated_end_date = serializers.DateTimeField()
+
 # SERIALIZER
 from .models import Review
 
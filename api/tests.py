@@ -1,3 +1,368 @@
-from django.test import TestCase
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+import zipfile
+from collections import deque
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from celery.exceptions import Retry
+from django.contrib.auth.models import User
+from django.db import connection
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from .fairshare import fair_share_wait
+from .meshes import decimate_mesh, load_obj, write_obj
+from .models import Data, DataType, DurationStats, ExportMethod, Nerf, NerfModel, NerfObject, ProcessedData
+from .predictions import ESTIMATE_RELATED
+from .serializers import NerfModelSerializer
+from .utils import create_batch, link_cached_result, wait_for_turn
+
+class DataUploadViewTests(TestCase):
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        self.user = User.objects.create_user('uploader', password='password')
+        self.data_type = DataType.objects.create(name='video')
+
+    def test_session_upload_with_csrf_token(self):
+        """ The browser path: session auth parses the body for its CSRF check before the view runs. """
+        client = Client(enforce_csrf_checks=True)
+        client.force_login(self.user)
+        csrf_token = 'x' * 32
+        client.cookies['csrftoken'] = csrf_token
+        content = b'not really a video'
+
+        with override_settings(MEDIA_ROOT=self.media_root):
+            response = client.post('/api/data/upload/', {
+                'data_file': SimpleUploadedFile('capture.mp4', content),
+                'data_type': self.data_type.id,
+                'name': 'capture',
+            }, HTTP_X_CSRFTOKEN=csrf_token)
+
+        self.assertEqual(response.status_code, 201, response.content)
+        data = Data.objects.get(id=response.json()['id'])
+        self.assertEqual(data.content_hash, hashlib.sha256(content).hexdigest())
+        self.assertEqual(data.user, self.user)
+
+def create_nerf_object(user, **fields) -> NerfObject:
+    data = Data.objects.create(user=user, data_type=DataType.objects.get_or_create(name='video')[0], name='capture')
+    processed_data = ProcessedData.objects.create(user=user, data=data)
+    nerf_model = NerfModel.objects.create(user=user, processed_data=processed_data,
+                                          nerf=Nerf.objects.get_or_create(name='nerfacto')[0])
+    return NerfObject.objects.create(user=user, nerf_model=nerf_model,
+                                     export_method=ExportMethod.objects.get_or_create(name='tsdf')[0], **fields)
+
+class NerfObjectDownloadTests(TestCase):
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        user = User.objects.create_user('viewer', password='password')
+        self.content = bytes(range(100))
+        self.nerf_object = create_nerf_object(user, material_hash=hashlib.sha256(self.content).hexdigest(),
+                                              end_date=timezone.now())
+        self.nerf_object.material_file.name = f'nerf_objects/{self.nerf_object.id}/material_0.mtl'
+        self.nerf_object.save()
+        os.makedirs(os.path.join(self.media_root, 'nerf_objects', str(self.nerf_object.id)))
+        with open(os.path.join(self.media_root, self.nerf_object.material_file.name), 'wb') as file:
+            file.write(self.content)
+        self.client.force_login(user)
+
+    def get(self, **headers):
+        with override_settings(MEDIA_ROOT=self.media_root, FILE_SERVE_OFFLOAD=''):
+            response = self.client.get(f'/api/nerf-objects/{self.nerf_object.id}/material/', **headers)
+            body = b''.join(response.streaming_content) if response.streaming else response.content
+        return response, body
+
+    def test_open_ended_range(self):
+        response, body = self.get(HTTP_RANGE='bytes=0-')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 0-99/100')
+        self.assertEqual(body, self.content)
+
+    def test_suffix_range_longer_than_file(self):
+        response, body = self.get(HTTP_RANGE='bytes=-500')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 0-99/100')
+        self.assertEqual(body, self.content)
+
+    def test_range(self):
+        response, body = self.get(HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Length'], '10')
+        self.assertEqual(body, self.content[10:20])
+
+    def test_range_past_end_of_file(self):
+        response, _ = self.get(HTTP_RANGE='bytes=100-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */100')
+
+    def test_if_range(self):
+        etag = f'"{self.nerf_object.material_hash}"'
+        response, body = self.get(HTTP_RANGE='bytes=90-', HTTP_IF_RANGE=etag)
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(body, self.content[90:])
+
+        response, body = self.get(HTTP_RANGE='bytes=90-', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(body, self.content)
+
+    def test_if_none_match(self):
+        response, _ = self.get(HTTP_IF_NONE_MATCH=f'"{self.nerf_object.material_hash}"')
+        self.assertEqual(response.status_code, 304)
+
+class MeshTests(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+
+    def write(self, name: str, text: str) -> str:
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as file:
+            file.write(text)
+        return path
+
+    def grid_mesh(self, size: int) -> dict:
+        """ A flat `size` x `size` grid of quads split in two triangles, with uvs and normals. """
+        lines = ['mtllib material_0.mtl']
+        for y in range(size + 1):
+            for x in range(size + 1):
+                lines += [f'v {x} {y} 0', f'vt {x / size} {y / size}', 'vn 0 0 1']
+        lines.append('usemtl material_0')
+        for y in range(size):
+            for x in range(size):
+                a = y * (size + 1) + x + 1
+                b, c, d = a + 1, a + size + 1, a + size + 2
+                lines += [f'f {a}/{a}/{a} {b}/{b}/{b} {d}/{d}/{d}', f'f {a}/{a}/{a} {d}/{d}/{d} {c}/{c}/{c}']
+        return load_obj(self.write('grid.obj', '\n'.join(lines) + '\n'))
+
+    def test_load_obj_negative_indices(self):
+        mesh = load_obj(self.write('relative.obj', (
+            'v 0 0 0\nv 1 0 0\nv 0 1 0\nv 1 1 0\n'
+            'vt 0 0\nvt 1 0\nvt 0 1\nvt 1 1\n'
+            'vn 0 0 1\n'
+            'f -4/-4/-1 -3/-3/-1 -2/-2/-1\n'
+            'f 2/2/1 4/4/1 3/3/1\n')))
+        np.testing.assert_array_equal(mesh['faces'], [[[0, 0, 0], [1, 1, 0], [2, 2, 0]],
+                                                      [[1, 1, 0], [3, 3, 0], [2, 2, 0]]])
+
+    def test_write_obj_round_trip(self):
+        for face, keys in [('f 1/1/1 2/2/1 3/3/1', ['uvs', 'normals']), ('f 1/1 2/2 3/3', ['uvs']),
+                           ('f 1//1 2//1 3//1', ['normals']), ('f 1 2 3', [])]:
+            with self.subTest(face=face):
+                mesh = load_obj(self.write('mesh.obj', (
+                    'mtllib material_0.mtl\nv 0 0 0\nv 1 0 0\nv 0 1 0\nvt 0 0\nvt 1 0\nvt 0 1\nvn 0 0 1\n'
+                    f'usemtl material_0\n{face}\n')))
+                write_obj(mesh, os.path.join(self.directory, 'copy.obj'))
+                copy = load_obj(os.path.join(self.directory, 'copy.obj'))
+                for key in ['positions', 'faces'] + keys:
+                    np.testing.assert_array_almost_equal(copy[key], mesh[key])
+                self.assertEqual(copy['materials'], mesh['materials'])
+
+    def test_decimate_to_target(self):
+        mesh = self.grid_mesh(16)
+        lod = decimate_mesh(mesh, 0.25)
+        self.assertGreater(len(lod['faces']), 0)
+        self.assertLessEqual(len(lod['faces']), len(mesh['faces']) * 0.25)
+        for column, key in enumerate(['positions', 'uvs', 'normals']):
+            self.assertTrue(((lod['faces'][:, :, column] >= 0) & (lod['faces'][:, :, column] < len(lod[key]))).all())
+
+    def test_decimate_below_one_face(self):
+        """ A target of less than a face still leaves the fewest faces any grid keeps. """
+        mesh = self.grid_mesh(1)
+        lod = decimate_mesh(mesh, 0.05)
+        self.assertGreater(len(lod['faces']), 0)
+        self.assertLessEqual(len(lod['faces']), len(mesh['faces']))
+
+class BundleNerfObjectViewTests(TestCase):
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        self.user = User.objects.create_user('viewer', password='password')
+        self.nerf_object = create_nerf_object(self.user)
+        self.client.force_login(self.user)
+
+    def test_bundle(self):
+        files = {'object_file': 'mesh.obj', 'material_file': 'material_0.mtl', 'texture_file': 'material_0.png'}
+        os.makedirs(os.path.join(self.media_root, 'nerf_objects', str(self.nerf_object.id)))
+        for field, name in files.items():
+            getattr(self.nerf_object, field).name = f'nerf_objects/{self.nerf_object.id}/{name}'
+            with open(os.path.join(self.media_root, getattr(self.nerf_object, field).name), 'w') as file:
+                file.write(name)
+        self.nerf_object.save()
+
+        with override_settings(MEDIA_ROOT=self.media_root):
+            response = self.client.get(f'/api/nerf-objects/{self.nerf_object.id}/bundle/')
+            content = b''.join(response.streaming_content)
+
+        self.assertEqual(response.status_code, 200)
+        with zipfile.ZipFile(io.BytesIO(content)) as bundle:
+            self.assertEqual({name: bundle.read(name).decode() for name in bundle.namelist()},
+                             {name: name for name in files.values()})
+
+    def test_missing_files(self):
+        """ An object whose export has not written its files yet has nothing to bundle. """
+        response = self.client.get(f'/api/nerf-objects/{self.nerf_object.id}/bundle/')
+        self.assertEqual(response.status_code, 404)
+
+class CancelCachedJobTests(TestCase):
+
+    def setUp(self):
+        data_type = DataType.objects.create(name='video')
+        self.owner = User.objects.create_user('owner', password='password')
+        self.other = User.objects.create_user('other', password='password')
+        self.jobs = []
+        for user in (self.owner, self.other, self.other):
+            data = Data.objects.create(user=user, data_type=data_type, name='capture', content_hash='a' * 64)
+            job = ProcessedData.objects.create(user=user, data=data)
+            link_cached_result(job)
+            self.jobs.append(job)
+
+    def test_cancel_source_hands_over_to_other_users_rows(self):
+        source, leader, follower = self.jobs
+        self.assertEqual(leader.cache_source, source)
+        self.assertEqual(follower.cache_source, source)
+
+        client = Client()
+        client.force_login(self.owner)
+        with mock.patch('api.utils.job_signature') as job_signature, \
+                self.captureOnCommitCallbacks(execute=True):
+            response = client.post(f'/api/processed-data/{source.id}/cancel/')
+
+        self.assertEqual(response.status_code, 200, response.content)
+        for job in self.jobs:
+            job.refresh_from_db()
+        self.assertEqual(source.status, 'cancelled')
+        self.assertEqual((leader.status, leader.cache_source), ('in_progress', None))
+        self.assertEqual((follower.status, follower.cache_source), ('in_progress', leader))
+        job_signature.assert_called_once_with(leader)
+        job_signature.return_value.delay.assert_called_once_with()
+
+    def test_cancel_follower_leaves_source_running(self):
+        source, leader, _ = self.jobs
+        client = Client()
+        client.force_login(self.other)
+        with mock.patch('api.utils.job_signature') as job_signature:
+            response = client.post(f'/api/processed-data/{leader.id}/cancel/')
+
+        self.assertEqual(response.status_code, 200, response.content)
+        source.refresh_from_db()
+        self.assertEqual(source.status, 'in_progress')
+        job_signature.assert_not_called()
+
+@override_settings(FAIR_SHARE_MAX_RUNNING={'train_model': 0, 'export_object': 0})
+class JobEstimateSerializerTests(TestCase):
+
+    def test_list_queries_do_not_grow_with_jobs(self):
+        user = User.objects.create_user('estimator', password='password')
+        DurationStats.objects.create(stage='train_model', name='', count=10, sum_time=6000)
+        for _ in range(6):
+            processed_data = create_nerf_object(user).nerf_model.processed_data
+            NerfModel.objects.create(user=user, processed_data=processed_data, nerf=Nerf.objects.get(name='nerfacto'))
+        jobs = NerfModel.objects.select_related(*ESTIMATE_RELATED[NerfModel]).order_by('id')
+
+        queries = []
+        for count in (2, 6):
+            with CaptureQueriesContext(connection) as context:
+                data = NerfModelSerializer(jobs[:count], many=True).data
+            queries.append(len(context))
+            self.assertTrue(all(job['eta'] and job['predicted_run_time'] == 600 for job in data))
+        self.assertEqual(queries[0], queries[1])
+
+class CreateBatchTests(TestCase):
+
+    @override_settings(JOB_EVENTS_REDIS_URL='redis://localhost:6379/0')
+    def test_events_published_once_committed_in_one_round_trip(self):
+        user = User.objects.create_user('batcher', password='password')
+        data_type = DataType.objects.create(name='video')
+        jobs = [{'data': Data.objects.create(user=user, data_type=data_type, name=f'capture {index}')}
+                for index in range(3)]
+
+        with mock.patch('api.events.publisher') as publisher:
+            with self.captureOnCommitCallbacks(execute=True):
+                _, pending = create_batch(ProcessedData, user, jobs)
+                publisher.pipeline.assert_not_called()
+
+        self.assertEqual(len(pending), 3)
+        pipeline = publisher.pipeline.return_value
+        self.assertEqual(pipeline.publish.call_count, 3)
+        pipeline.execute.assert_called_once_with()
+
+@override_settings(FAIR_SHARE_MAX_RUNNING={'train_model': 0, 'export_object': 0})
+class FairShareTests(TestCase):
+
+    def setUp(self):
+        self.data_type = DataType.objects.create(name='video')
+        self.nerf = Nerf.objects.create(name='nerfacto')
+        self.heavy = User.objects.create_user('heavy', password='password')
+        self.light = User.objects.create_user('light', password='password')
+
+    def training(self, user, **fields):
+        data = Data.objects.create(user=user, data_type=self.data_type, name='capture')
+        processed_data = ProcessedData.objects.create(user=user, data=data, status='complete', end_date=timezone.now())
+        return NerfModel.objects.create(user=user, processed_data=processed_data, nerf=self.nerf, **fields)
+
+    def run_single_worker(self, jobs) -> list:
+        """ Runs the jobs one at a time in queue order, a task told to wait going back to the end of the queue. """
+        queue, ran = deque(jobs), []
+        while queue:
+            job = queue.popleft()
+            job.refresh_from_db()
+            task = mock.Mock()
+            task.retry.side_effect = Retry
+            try:
+                wait_for_turn(task, job, 'TEST')
+            except Retry:
+                queue.append(job)
+                continue
+            now = timezone.now()
+            NerfModel.objects.filter(id=job.id).update(status='complete', started_at=now - timedelta(hours=1), finished_at=now)
+            ran.append(job.user.username)
+        return ran
+
+    def test_light_user_goes_next_on_a_single_worker(self):
+        heavy_jobs = [self.training(self.heavy) for _ in range(4)]
+        light_job = self.training(self.light)
+        self.assertEqual(self.run_single_worker(heavy_jobs + [light_job]), ['heavy', 'light', 'heavy', 'heavy', 'heavy'])
+
+    def test_user_with_less_usage_goes_first(self):
+        now = timezone.now()
+        self.training(self.heavy, status='complete', started_at=now - timedelta(hours=2), finished_at=now)
+        heavy_job, light_job = self.training(self.heavy), self.training(self.light)
+        self.assertEqual(fair_share_wait(heavy_job), 'share')
+        self.assertIsNone(fair_share_wait(light_job))
+
+    def test_job_of_unfinished_previous_stage_does_not_wait(self):
+        now = timezone.now()
+        self.training(self.heavy, status='complete', started_at=now - timedelta(hours=2), finished_at=now)
+        heavy_job, light_job = self.training(self.heavy), self.training(self.light)
+        ProcessedData.objects.filter(id=light_job.processed_data_id).update(status='in_progress', end_date=None)
+        self.assertIsNone(fair_share_wait(heavy_job))
+
+    @override_settings(TRAIN_MODEL_TIMEOUT=60)
+    def test_job_queued_past_the_stage_timeout_does_not_wait(self):
+        now = timezone.now()
+        self.training(self.heavy, status='complete', started_at=now - timedelta(hours=2), finished_at=now)
+        heavy_job = self.training(self.heavy)
+        self.training(self.light, queued_at=now - timedelta(minutes=5))
+        self.assertIsNone(fair_share_wait(heavy_job))
+
+    @override_settings(FAIR_SHARE_MAX_RUNNING={'train_model': 1, 'export_object': 0})
+    def test_user_at_cap_waits_and_does_not_hold_others_back(self):
+        self.training(self.heavy, started_at=timezone.now())
+        heavy_job, light_job = self.training(self.heavy), self.training(self.light)
+        self.assertEqual(fair_share_wait(heavy_job), 'cap')
+        # the light user has used more, but the heavy user cannot start another job anyway
+        now = timezone.now()
+        self.training(self.light, status='complete', started_at=now - timedelta(hours=5), finished_at=now)
+        self.assertIsNone(fair_share_wait(light_job))
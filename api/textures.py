@@ -0,0 +1,49 @@
+import os
+
+from PIL import Image
+
+TEXTURE_FORMATS = {
+    'png': {'extension': '.png', 'content_type': 'image/png', 'options': {'optimize': True}},
+    'webp': {'extension': '.webp', 'content_type': 'image/webp', 'options': {'method': 6}},
+}
+
+def write_texture_variants(texture_path: str, sizes: [int], webp_quality: int) -> [dict]:
+    """
+    Writes downscaled PNG and WebP copies of a texture next to it.
+
+    Each level is bounded by one of `sizes` on its longest side; sizes at or
+    above the original resolution only get a full resolution WebP, since the
+    original PNG already covers them. Returns one dict per written file.
+    """
+    base_path, _ = os.path.splitext(texture_path)
+    variants = []
+
+    with Image.open(texture_path) as texture:
+        texture.load()
+        original_size = max(texture.size)
+        levels = sorted({size for size in sizes if size < original_size} | {original_size}, reverse=True)
+
+        for size in levels:
+            level = texture.copy()
+            if size < original_size:
+                level.thumbnail((size, size), Image.LANCZOS)
+
+            for texture_format, spec in TEXTURE_FORMATS.items():
+                if texture_format == 'png' and size == original_size:
+                    continue
+
+                options = dict(spec['options'])
+                if texture_format == 'webp':
+                    options['quality'] = webp_quality
+
+                path = f'{base_path}_{size}{spec["extension"]}'
+                level.save(path, format=texture_format.upper(), **options)
+                variants.append({
+                    'size': size,
+                    'format': texture_format,
+                    'path': path,
+                    'width': level.width,
+                    'height': level.height,
+                })
+
+    return variants
@@ -0,0 +1,53 @@
+import hashlib
+import os
+
+from django.core.files.storage import default_storage
+from django.core.files.uploadhandler import FileUploadHandler
+
+class HashingUploadHandler(FileUploadHandler):
+    """
+    Computes the SHA-256 of every uploaded file while Django streams it in.
+
+    It only observes the chunks and hands them on unchanged, so the default
+    memory/temporary file handlers placed after it still store the file.
+    """
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.digests = {}
+        self.hasher = None
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.hasher = hashlib.sha256()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.hasher.update(raw_data)
+        return raw_data
+
+    def file_complete(self, file_size):
+        self.digests[self.field_name] = self.hasher.hexdigest()
+        return None
+
+def content_addressed_name(digest: str, filename: str) -> str:
+    """ Storage name of an uploaded Data file, derived from its content hash. """
+    extension = os.path.splitext(filename)[1].lower()
+    return f'data/{digest[:2]}/{digest}{extension}'
+
+def store_content_addressed(file, digest: str) -> str:
+    """ Saves an uploaded file under its content hash, reusing the stored copy if there is one. """
+    name = content_addressed_name(digest, file.name)
+    if default_storage.exists(name):
+        return name
+    return default_storage.save(name, file)
+
+def move_content_addressed(file_path: str, digest: str, filename: str) -> str:
+    """ Moves a file already on disk to its content-addressed name, or drops it if that copy exists. """
+    name = content_addressed_name(digest, filename)
+    target_path = default_storage.path(name)
+    if os.path.exists(target_path):
+        os.remove(file_path)
+    else:
+        os.makedirs(os.path.dirname(target_path), exist_ok=True)
+        os.replace(file_path, target_path)
+    return name
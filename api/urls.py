@@ -4,6 +4,7 @@ from django.urls import path
 from .views import UserRegistrationView, UserLoginView
 # data
 from .views import DataUploadView, UserDataView, DataDetailView
+from .views import DataUploadSessionCreateView, DataUploadSessionView, DataUploadSessionCompleteView
 # datatypes
 from .views import AllDataTypesView
 # processed data
@@ -16,7 +17,21 @@ from .views import GenerateNerfModelView, UserNerfModelsView, NerfModelDetailVie
 from .views import AllExportMethodsView
 # nerf object
 from .views import GenerateNerfObjectView, UserNerfObjectsView, NerfObjectDetailView
-from .views import MeshNerfObjectView, TextureNerfObjectView, MaterialNerfObjectView
+from .views import MeshNerfObjectView, TextureNerfObjectView, MaterialNerfObjectView, GlbNerfObjectView, BundleNerfObjectView
+# batch generation
+from .views import BatchGenerateProcessedDataView, BatchGenerateNerfModelView, BatchGenerateNerfObjectView
+# pipeline
+from .views import RunPipelineView
+# sweeps
+from .views import RunSweepView, UserSweepsView, SweepDetailView
+# job progress
+from .views import ProcessedDataProgressView, NerfModelProgressView, NerfObjectProgressView
+# job cancellation
+from .views import CancelProcessedDataView, CancelNerfModelView, CancelNerfObjectView
+# job events
+from .views import job_events_view
+# metrics
+from .views import metrics_view
 # reviews
 from .views import AddReviewView, AllReviewsView, DataTypeReviewsView, DataReviewsView, NerfReviewsView, NerfModelReviewsView, ExportMethodReviewsView, NerfObjectReviewsView 
 
@@ -28,6 +43,9 @@ urlpatterns = [
 
     # data
     path('data/upload/', DataUploadView.as_view(), name='upload-data'),
+    path('data/uploads/', DataUploadSessionCreateView.as_view(), name='create-data-upload'),
+    path('data/uploads/<uuid:upload_id>/', DataUploadSessionView.as_view(), name='data-upload'),
+    path('data/uploads/<uuid:upload_id>/complete/', DataUploadSessionCompleteView.as_view(), name='complete-data-upload'),
     path('data/user/', UserDataView.as_view(), name='user-data'),
     path('data/<int:id>/', DataDetailView.as_view(), name='id-data'),
 
@@ -36,27 +54,52 @@ urlpatterns = [
 
     # processed-data
     path('processed-data/generate/', GenerateProcessedDataView.as_view(), name='generate-processed-data'),
+    path('processed-data/generate/batch/', BatchGenerateProcessedDataView.as_view(), name='batch-generate-processed-data'),
     path('processed-data/user/', UserProcessedDataView.as_view(), name='user-processed-data'),
     path('processed-data/<int:id>/', ProcessedDataDetailView.as_view(), name='id-processed-data'),
+    path('processed-data/<int:id>/progress/', ProcessedDataProgressView.as_view(), name='progress-processed-data'),
+    path('processed-data/<int:id>/cancel/', CancelProcessedDataView.as_view(), name='cancel-processed-data'),
 
     # nerfs
     path('nerfs/all/', AllNerfsView.as_view(), name='all-nerfs'),
 
     # nerf models
     path('nerf-models/generate/', GenerateNerfModelView.as_view(), name='generate-nerf-model'),
+    path('nerf-models/generate/batch/', BatchGenerateNerfModelView.as_view(), name='batch-generate-nerf-model'),
     path('nerf-models/user/', UserNerfModelsView.as_view(), name='user-nerf-models'),
     path('nerf-models/<int:id>/', NerfModelDetailView.as_view(), name='id-nerf-objects'),
+    path('nerf-models/<int:id>/progress/', NerfModelProgressView.as_view(), name='progress-nerf-models'),
+    path('nerf-models/<int:id>/cancel/', CancelNerfModelView.as_view(), name='cancel-nerf-models'),
 
     # export methods
     path('export-methods/all/', AllExportMethodsView.as_view(), name='all-export-methods'),
 
     # nerf objects
     path('nerf-objects/generate/', GenerateNerfObjectView.as_view(), name='generate-nerf-object'),
+    path('nerf-objects/generate/batch/', BatchGenerateNerfObjectView.as_view(), name='batch-generate-nerf-object'),
     path('nerf-objects/user/', UserNerfObjectsView.as_view(), name='user-nerf-objects'),
     path('nerf-objects/<int:id>/', NerfObjectDetailView.as_view(), name='id-nerf-objects'),
+    path('nerf-objects/<int:id>/progress/', NerfObjectProgressView.as_view(), name='progress-nerf-objects'),
+    path('nerf-objects/<int:id>/cancel/', CancelNerfObjectView.as_view(), name='cancel-nerf-objects'),
     path('nerf-objects/<int:nerf_object_id>/object/', MeshNerfObjectView.as_view(), name='object-nerf-objects'),
     path('nerf-objects/<int:nerf_object_id>/texture/', TextureNerfObjectView.as_view(), name='texture-nerf-objects'),
     path('nerf-objects/<int:nerf_object_id>/material/', MaterialNerfObjectView.as_view(), name='material-nerf-objects'),
+    path('nerf-objects/<int:nerf_object_id>/glb/', GlbNerfObjectView.as_view(), name='glb-nerf-objects'),
+    path('nerf-objects/<int:nerf_object_id>/bundle/', BundleNerfObjectView.as_view(), name='bundle-nerf-objects'),
+
+    # pipeline
+    path('pipeline/run/', RunPipelineView.as_view(), name='run-pipeline'),
+
+    # sweeps
+    path('sweeps/run/', RunSweepView.as_view(), name='run-sweep'),
+    path('sweeps/user/', UserSweepsView.as_view(), name='user-sweeps'),
+    path('sweeps/<int:id>/', SweepDetailView.as_view(), name='id-sweep'),
+
+    # job events
+    path('jobs/events/', job_events_view, name='job-events'),
+
+    # metrics
+    path('metrics/', metrics_view, name='metrics'),
 
     # reviews
     path('reviews/add/', AddReviewView.as_view(), name='add-review'),
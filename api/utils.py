@@ -1,18 +1,321 @@
-import subprocess
-from .models import User, Data, ProcessedData, ExportMethod, Nerf, NerfModel, NerfObject
-from celery import shared_task
+import hashlib
+import glob
+import json
+from datetime import datetime, timezone as dt_timezone
+import re
+import sys
+from .models import User, Data, ProcessedData, ExportMethod, Nerf, NerfModel, NerfObject, NerfObjectLod, NerfObjectTexture, Sweep, upload_directory_obj
+from celery import chain, chord, group, shared_task
+from celery.exceptions import MaxRetriesExceededError
 import os
 from dotenv import load_dotenv
 
-from django.core.files import File
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from PIL import Image
+
+from .downloads import write_precompressed_variants
+from .events import publish_job_events
+from .fairshare import fair_share_wait
+from .gpus import export_slots
+from .predictions import record_run
+from .progress import JobCancelled, ProgressTracker, parse_export_line, parse_process_data_line, parse_train_line, run_with_progress
+from .meshes import load_obj, decimate_mesh, mesh_statistics, write_obj, write_glb
+from .textures import write_texture_variants
 
 load_dotenv()
 
 ACTIVATE_NERF_STUDIO_COMMAND = "conda activate nerfstudio"
+# runs instead of the nerfstudio commands when USE_TEST_SCRIPT is set
+SIMULATOR_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'scripts', 'simulator.py')
 # ACTIVATE_FFMPEG = 'export PATH="$HOME/ffmpeg_build/bin:$PATH"'
 
-@shared_task
-def generate_processed_data(data: dict, processed_data_id: int) -> None:
+HASH_CHUNK_SIZE = 1024 * 1024
+
+def hash_file(file_path: str) -> str:
+    """ Returns the SHA-256 hex digest of a file, read in chunks. """
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+# Pipeline result cache: a job whose input content, stage and parameters match an
+# earlier job reuses its result instead of running again.
+
+NERF_OBJECT_RESULT_FIELDS = [
+    'object_file', 'texture_file', 'material_file', 'glb_file',
+    'object_hash', 'texture_hash', 'material_hash', 'glb_hash',
+    'vertex_count', 'face_count', 'bounding_box',
+    'object_size', 'texture_size', 'material_size', 'texture_width', 'texture_height',
+]
+
+RESULT_FIELDS = {
+    ProcessedData: ['processed_data_file', 'frame_count'],
+    NerfModel: ['model_file', 'has_normals'],
+    NerfObject: NERF_OBJECT_RESULT_FIELDS,
+}
+
+def pipeline_cache_key(instance) -> str:
+    """ Hash of (input content, stage, parameters) for a pipeline row, or '' when it cannot be cached. """
+    if isinstance(instance, ProcessedData):
+        parts = ['process_data', instance.data.content_hash, instance.data.data_type.name]
+    elif isinstance(instance, NerfModel):
+        parts = ['train_model', instance.processed_data.cache_key, instance.nerf.name]
+    else:
+        parts = ['export_object', instance.nerf_model.cache_key, instance.export_method.name]
+
+    # uploads from before content hashing have no key, and neither does anything built on them
+    if not parts[1]:
+        return ''
+    return hashlib.sha256('|'.join(parts).encode('utf-8')).hexdigest()
+
+def copy_result(source, target) -> None:
+    """ Gives `target` the outcome of the job it reuses. """
+    for field in RESULT_FIELDS[type(source)]:
+        setattr(target, field, getattr(source, field))
+
+    if isinstance(source, NerfObject):
+        target.lods.all().delete()
+        target.textures.all().delete()
+        for lod in source.lods.all():
+            lod.pk, lod.nerf_object = None, target
+            lod.save()
+        for texture in source.textures.all():
+            texture.pk, texture.nerf_object = None, target
+            texture.save()
+
+    target.status = source.status
+    target.save_endtime()
+
+def link_cached_result(instance) -> bool:
+    """
+    Points a new pipeline row at a completed or running job with the same cache key.
+
+    A completed job's result is copied at once, a running one is joined and hands
+    its result over when it ends. Returns whether the row needs no task of its own.
+    """
+    instance.cache_key = pipeline_cache_key(instance)
+    source = None
+    if instance.cache_key:
+        source = (type(instance).objects
+                  .filter(cache_key=instance.cache_key, cache_source__isnull=True,
+                          status__in=['complete', 'in_progress'])
+                  .exclude(id=instance.id)
+                  .order_by('status', '-id')
+                  .first())
+
+    if source is None:
+        instance.save()
+        return False
+
+    instance.cache_source = source
+    if source.status == 'complete':
+        copy_result(source, instance)
+    else:
+        instance.save()
+    return True
+
+def create_batch(model, user: User, jobs: [dict]) -> ([object], [object]):
+    """
+    Inserts many pipeline rows of one stage with a single bulk_create.
+
+    Result cache lookups are done in one query for the whole batch, and repeated
+    inputs within the batch join the first row that has them. Returns all the
+    rows, in order, and the ones that need a task of their own.
+    """
+    rows = [model(user=user, **job) for job in jobs]
+    for row in rows:
+        row.cache_key = pipeline_cache_key(row)
+
+    sources = {}
+    candidates = (model.objects
+                  .filter(cache_key__in={row.cache_key for row in rows if row.cache_key},
+                          cache_source__isnull=True, status__in=['complete', 'in_progress'])
+                  .order_by('status', '-id'))
+    for source in candidates:
+        sources.setdefault(source.cache_key, source)
+    for row in rows:
+        row.cache_source = sources.get(row.cache_key)
+
+    with transaction.atomic():
+        model.objects.bulk_create(rows)
+        leaders, followers = {}, []
+        for row in rows:
+            if row.cache_key and row.cache_source is None:
+                if row.cache_key in leaders:
+                    row.cache_source = leaders[row.cache_key]
+                    followers.append(row)
+                else:
+                    leaders[row.cache_key] = row
+        model.objects.bulk_update(followers, ['cache_source'])
+
+    queued = []
+    for row in rows:
+        if row.cache_source and row.cache_source.status == 'complete':
+            copy_result(row.cache_source, row)
+        else:
+            queued.append(row)
+    # bulk_create sends no post_save, so announce the queued rows here, all at once
+    transaction.on_commit(lambda: publish_job_events(queued))
+
+    return rows, [row for row in rows if row.cache_source is None]
+
+def hand_over_followers(instance) -> None:
+    """
+    Gives the rows that joined a cancelled job a job of their own, since they may
+    belong to other users: the first one gets its own task and the others join it.
+    """
+    followers = list(instance.reused_by.filter(status='in_progress').order_by('id'))
+    if not followers:
+        return
+    leader = followers[0]
+    type(instance).objects.filter(id__in=[follower.id for follower in followers[1:]]).update(cache_source=leader)
+    leader.cache_source = None
+    leader.save(update_fields=['cache_source'])
+    print(f"[PIPELINE_CACHE]: {type(instance).__name__} {instance.id} CANCELLED, HANDED OVER TO {leader.id}")
+    transaction.on_commit(lambda: job_signature(leader).delay())
+
+def propagate_result(instance) -> None:
+    """ Hands a finished job's outcome to the rows that joined it while it ran, except a cancellation. """
+    if instance.status == 'cancelled':
+        hand_over_followers(instance)
+        return
+    for follower in instance.reused_by.filter(status='in_progress'):
+        copy_result(instance, follower)
+
+def job_priority(instance) -> int:
+    """ Queue priority of a pipeline row's task: 0 runs first, see NERF_PRIORITIES and EXPORT_METHOD_PRIORITIES. """
+    if isinstance(instance, NerfModel):
+        return settings.NERF_PRIORITIES.get(instance.nerf.name, settings.CELERY_TASK_DEFAULT_PRIORITY)
+    if isinstance(instance, NerfObject):
+        return settings.EXPORT_METHOD_PRIORITIES.get(instance.export_method.name, settings.CELERY_TASK_DEFAULT_PRIORITY)
+    return settings.CELERY_TASK_DEFAULT_PRIORITY
+
+def already_finished(instance, label: str) -> bool:
+    """
+    Whether a job ended before its task got to run it: cancelled while queued,
+    or finished by an earlier delivery of a late-acknowledged task.
+    """
+    if instance.status == 'in_progress':
+        return False
+    print(f"[{label}]: ALREADY {instance.status.upper()}")
+    return True
+
+def end_job(instance, label: str) -> bool:
+    """
+    Saves the final status set on a running job, unless the job already ended,
+    e.g. cancelled after its command exited but before the watchdog noticed: the
+    status only moves away from 'in_progress' once, so that ending stands and
+    `instance` gets its status. Returns whether the job was ended here.
+    """
+    model = type(instance)
+    if not model.objects.filter(id=instance.id, status='in_progress').update(status=instance.status):
+        instance.status = model.objects.values_list('status', flat=True).get(id=instance.id)
+        print(f"[{label}]: ALREADY {instance.status.upper()}")
+        return False
+    instance.save_endtime()
+    return True
+
+def mark_queued(task, instance, upstream=None) -> None:
+    """
+    Stores when the job became ready for a worker: when its task was published
+    (stamped on the message in nerfcfm.celery), or when the `upstream` job it
+    builds on ended if that came later, so that waiting on the previous stage
+    does not count as queue wait. The first value stands across retries and redeliveries.
+    """
+    if instance.queued_at:
+        return
+    stamp = getattr(task.request, 'queued_at', None)
+    # eager runs and messages from before the stamp have none
+    instance.queued_at = datetime.fromtimestamp(stamp, dt_timezone.utc) if stamp else timezone.now()
+    if upstream is not None and upstream.end_date:
+        instance.queued_at = max(instance.queued_at, upstream.end_date)
+    type(instance).objects.filter(id=instance.id).update(queued_at=instance.queued_at)
+
+def mark_started(instance) -> None:
+    """ Stores when the job's command began running, so queue wait and run time can be told apart. """
+    instance.started_at = timezone.now()
+    type(instance).objects.filter(id=instance.id).update(started_at=instance.started_at)
+
+CHECKPOINT_RE = re.compile(r'step-(\d+)\.ckpt$')
+
+def latest_checkpoint(model_dir: str):
+    """ Directory and step of the newest nerfstudio checkpoint under a training output directory, or (None, None). """
+    latest_dir, latest_step = None, None
+    for path in glob.glob(os.path.join(model_dir, '**', 'nerfstudio_models', 'step-*.ckpt'), recursive=True):
+        step = int(CHECKPOINT_RE.search(path).group(1))
+        if latest_step is None or step > latest_step:
+            latest_dir, latest_step = os.path.dirname(path), step
+    return latest_dir, latest_step
+
+# left in a stage's output directory once its command exited with 0, checked before running it again
+OUTPUTS_COMPLETE_MARKER = '.complete'
+
+def outputs_complete(output_dir: str) -> bool:
+    return os.path.exists(os.path.join(output_dir, OUTPUTS_COMPLETE_MARKER))
+
+def mark_outputs_complete(output_dir: str) -> None:
+    """ Records that a stage's command succeeded, so files a killed run left half written are never taken for its outputs. """
+    os.makedirs(output_dir, exist_ok=True)
+    open(os.path.join(output_dir, OUTPUTS_COMPLETE_MARKER), 'w').close()
+
+def count_frames(output_dir: str):
+    """ Frames listed in the transforms.json written by ns-process-data, or None when it cannot be read. """
+    try:
+        with open(os.path.join(output_dir, 'transforms.json')) as file:
+            return len(json.load(file)['frames'])
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+def wait_for_upstream(task, upstream, instance, label: str) -> bool:
+    """
+    Checks the job a task builds on before it runs.
+
+    A running upstream job (e.g. the previous pipeline stage, or a job it joined)
+    makes the task retry later; a failed one fails `instance` too. Returns whether
+    the task can go ahead.
+    """
+    if upstream.status == 'in_progress':
+        try:
+            raise task.retry(countdown=settings.PIPELINE_UPSTREAM_RETRY_DELAY,
+                             max_retries=settings.PIPELINE_UPSTREAM_MAX_RETRIES)
+        except MaxRetriesExceededError:
+            print(f"[{label}]: UPSTREAM TIMEOUT")
+    elif upstream.status == 'complete':
+        return True
+    else:
+        print(f"[{label}]: UPSTREAM FAILED")
+
+    instance.status = 'failed'
+    end_job(instance, label)
+    propagate_result(instance)
+    return False
+
+def wait_for_turn(task, instance, label: str) -> None:
+    """
+    Puts the task back in its queue while fair share lets other users' jobs of the stage go first.
+
+    The turn once taken is stored on the row: the job then counts as running, even while
+    an export waits for a GPU slot, and keeps its turn if the task is delivered again.
+    """
+    model = type(instance)
+    if instance.turn_taken_at:
+        return
+    reason = fair_share_wait(instance)
+    if reason:
+        print(f"[{label}]: WAITING FOR TURN ({reason.upper()})")
+        raise task.retry(countdown=settings.FAIR_SHARE_RETRY_DELAY)
+
+    instance.turn_taken_at = timezone.now()
+    model.objects.filter(id=instance.id).update(turn_taken_at=instance.turn_taken_at)
+
+# Pipeline tasks are acknowledged once they end, so a job whose worker died is
+# delivered again and picks up from the outputs and checkpoints already on disk.
+
+@shared_task(bind=True, acks_late=True, reject_on_worker_lost=True)
+def generate_processed_data(self, data: dict, processed_data_id: int) -> None:
 
     print(data)
     user_id = data.get('user')
@@ -22,40 +325,65 @@ def generate_processed_data(data: dict, processed_data_id: int) -> None:
     data = Data.objects.get(id=data_id)
 
     processed_data = ProcessedData.objects.get(id=processed_data_id)
+
+    if already_finished(processed_data, 'PROCESS_DATA_TASK'):
+        return
+
+    mark_queued(self, processed_data)
+    mark_started(processed_data)
     
     try:
 
         process_command = None
         if(os.getenv("USE_TEST_SCRIPT")):
-            process_command = ['python', 'api/scripts/test_process_data.py', os.getenv("MAX_TIME_SCRIPT"), os.getenv("MIN_TIME_SCRIPT"), str(processed_data.id)]
+            process_command = [sys.executable, SIMULATOR_SCRIPT, 'process_data', str(processed_data.artifact_id), '--name', data.data_type.name]
         else:
-            data_path = data.data_file.name
-            data_name = data_path.split("/")[-1]
-            ns_process_data_command = f"ns-process-data video --data media/data/{data_name}/ --output-dir media/processed_data/{processed_data_id}/"
+            data_path = data.data_file.path
+            ns_process_data_command = f"ns-process-data video --data {data_path} --output-dir media/processed_data/{processed_data.artifact_id}/"
             process_command = f"{ACTIVATE_NERF_STUDIO_COMMAND} && {ns_process_data_command}"
         
-        process_data_result = subprocess.run(process_command)
+        resumed = outputs_complete(f'media/processed_data/{processed_data.artifact_id}/')
+        if resumed:
+            print("[PROCESS_DATA_TASK]: OUTPUT ALREADY WRITTEN")
+            returncode = 0
+        else:
+            returncode = run_with_progress(process_command, parse_process_data_line, ProgressTracker(processed_data),
+                                           settings.PROCESS_DATA_TIMEOUT)
         
-        if process_data_result.returncode == 0:
+        if returncode == 0:
+                mark_outputs_complete(f'media/processed_data/{processed_data.artifact_id}/')
+                processed_data.frame_count = count_frames(f'media/processed_data/{processed_data.artifact_id}/')
                 processed_data.status = 'complete'
                 print("[PROCESS_DATA_TASK]: SUCCESS")
         else:
                 processed_data.status = 'failed'
                 print("[PROCESS_DATA_TASK]: RETCODE ERROR (not 0)")
             
-        processed_data.save_endtime()
+        end_job(processed_data, 'PROCESS_DATA_TASK')
+        # a resumed run took a fraction of the time, and would skew the predictions
+        if not resumed:
+            record_run(processed_data)
+
+    except JobCancelled:
+
+        processed_data.status = 'cancelled'
+        end_job(processed_data, 'PROCESS_DATA_TASK')
+        print("[PROCESS_DATA_TASK]: CANCELLED")
 
     except Exception as e:
 
         processed_data.status = 'failed'
-        processed_data.save_endtime()
+        end_job(processed_data, 'PROCESS_DATA_TASK')
         print("[PROCESS_DATA_TASK]: ERROR")
         print('-- PROCESS_DATA EXCEPTION START --')
         print(e)
         print('-- PROCESS_DATA EXCEPTION END --')
 
-@shared_task
-def generate_nerf_model(data: dict, nerf_model_id: int) -> None:
+    propagate_result(processed_data)
+
+# waiting for a turn can take any number of retries, see fairshare
+@shared_task(bind=True, acks_late=True, reject_on_worker_lost=True, max_retries=None)
+def generate_nerf_model(self, data: dict, nerf_model_id: int) -> None:
 
     print(data)
     processed_data_id = data.get('processed_data')
@@ -67,38 +395,160 @@ def generate_nerf_model(data: dict, nerf_model_id: int) -> None:
     processed_data = ProcessedData.objects.get(id=processed_data_id)
 
     nerf_model = NerfModel.objects.get(id=nerf_model_id)
+
+    if already_finished(nerf_model, 'GENERATE_MODEL_TASK'):
+        return
+
+    if not wait_for_upstream(self, processed_data, nerf_model, 'GENERATE_MODEL_TASK'):
+        return
+    mark_queued(self, nerf_model, processed_data)
+    wait_for_turn(self, nerf_model, 'GENERATE_MODEL_TASK')
+    mark_started(nerf_model)
     
     try:
 
+        checkpoint_dir, checkpoint_step = latest_checkpoint(f'media/nerf_models/{nerf_model.artifact_id}/')
+        if checkpoint_dir:
+            print(f"[GENERATE_MODEL_TASK]: RESUMING FROM STEP {checkpoint_step}")
+
         train_command = None
         if(os.getenv("USE_TEST_SCRIPT")):
-            train_command = ['python', 'api/scripts/test_nerf_model.py', os.getenv("MAX_TIME_SCRIPT"), os.getenv("MIN_TIME_SCRIPT"), str(nerf_model.id)]
+            train_command = [sys.executable, SIMULATOR_SCRIPT, 'train_model', str(nerf_model.artifact_id), '--name', nerf.name]
+            if checkpoint_dir:
+                train_command += ['--load-dir', checkpoint_dir]
         else:
-            ns_train_command = f"ns-train nerfacto --data media/processed_data/{processed_data_id}/ --output-dir media/nerf_models/{nerf_model_id}/ --viewer.quit-on-train-completion True"          
+            ns_train_command = f"ns-train nerfacto --data media/processed_data/{processed_data.artifact_id}/ --output-dir media/nerf_models/{nerf_model.artifact_id}/ --viewer.quit-on-train-completion True"          
+            if checkpoint_dir:
+                ns_train_command += f" --load-dir {checkpoint_dir}"
             train_command = f"{ACTIVATE_NERF_STUDIO_COMMAND} && {ns_train_command}"
 
-        train_result = subprocess.run(train_command)
+        returncode = run_with_progress(train_command, parse_train_line, ProgressTracker(nerf_model),
+                                       settings.TRAIN_MODEL_TIMEOUT)
         
-        if train_result.returncode == 0:
+        if returncode == 0:
             nerf_model.status = 'complete'
             print("[GENERATE_MODEL_TASK]: SUCCESS")
         else:
             nerf_model.status = 'failed'
             print("[GENERATE_MODEL_TASK]: RETCODE ERROR (not 0)")
     
-        nerf_model.save_endtime()
+        end_job(nerf_model, 'GENERATE_MODEL_TASK')
+        if not checkpoint_dir:
+            record_run(nerf_model)
+
+    except JobCancelled:
+
+        nerf_model.status = 'cancelled'
+        end_job(nerf_model, 'GENERATE_MODEL_TASK')
+        print("[GENERATE_MODEL_TASK]: CANCELLED")
 
     except Exception as e:
 
         nerf_model.status = 'failed'
-        nerf_model.save_endtime()
+        end_job(nerf_model, 'GENERATE_MODEL_TASK')
         print("[GENERATE_MODEL_TASK]: ERROR")
         print('-- GENERATE_NERF_MODEL EXCEPTION START --')
         print(e)
         print('-- GENERATE_NERF_MODEL EXCEPTION END --')
 
-@shared_task
-def generate_nerf_object(data: dict, nerf_object_id: int) -> None:
+    propagate_result(nerf_model)
+
+def convert_nerf_object_to_glb(nerf_object: NerfObject, mesh: dict, texture_bytes: bytes) -> None:
+    """ Converts the exported OBJ into a GLB stored next to it. """
+    glb_name = upload_directory_obj(nerf_object, 'mesh.glb')
+    write_glb(mesh, os.path.join(settings.MEDIA_ROOT, glb_name), texture_bytes)
+    nerf_object.glb_file.name = glb_name
+    nerf_object.glb_hash = hash_file(nerf_object.glb_file.path)
+
+def generate_nerf_object_lods(nerf_object: NerfObject, mesh: dict, texture_bytes: bytes) -> None:
+    """
+    Stores a decimated OBJ and GLB for every LOD ratio below 1 in NERF_OBJECT_LOD_RATIOS.
+
+    Every level is written before the previous LODs are replaced, so a failure
+    leaves the object with its old LOD set rather than part of a new one.
+    """
+    lods = []
+    ratios = sorted((ratio for ratio in settings.NERF_OBJECT_LOD_RATIOS if ratio < 1), reverse=True)
+    for level, ratio in enumerate(ratios, start=1):
+        lod_mesh = decimate_mesh(mesh, ratio)
+        if not len(lod_mesh['faces']):
+            break
+        lod = NerfObjectLod(nerf_object=nerf_object, level=level, ratio=ratio, face_count=len(lod_mesh['faces']))
+
+        lod.object_file.name = upload_directory_obj(nerf_object, f'mesh_lod{level}.obj')
+        write_obj(lod_mesh, lod.object_file.path)
+        write_precompressed_variants(lod.object_file.path)
+        lod.object_hash = hash_file(lod.object_file.path)
+
+        lod.glb_file.name = upload_directory_obj(nerf_object, f'mesh_lod{level}.glb')
+        write_glb(lod_mesh, lod.glb_file.path, texture_bytes)
+        lod.glb_hash = hash_file(lod.glb_file.path)
+        lods.append(lod)
+
+    with transaction.atomic():
+        nerf_object.lods.all().delete()
+        NerfObjectLod.objects.bulk_create(lods)
+
+def generate_nerf_object_textures(nerf_object: NerfObject) -> None:
+    """ Stores the downscaled and WebP levels of the exported texture. """
+    nerf_object.textures.all().delete()
+
+    variants = write_texture_variants(nerf_object.texture_file.path,
+                                      settings.NERF_OBJECT_TEXTURE_SIZES,
+                                      settings.NERF_OBJECT_TEXTURE_WEBP_QUALITY)
+    for variant in variants:
+        texture = NerfObjectTexture(nerf_object=nerf_object, format=variant['format'], size=variant['size'],
+                                    width=variant['width'], height=variant['height'],
+                                    texture_hash=hash_file(variant['path']))
+        texture.texture_file.name = os.path.relpath(variant['path'], settings.MEDIA_ROOT)
+        texture.save()
+
+def compute_nerf_object_statistics(nerf_object: NerfObject) -> None:
+    """ Stores mesh counts, bounds, file sizes and texture resolution on the object. """
+    statistics = mesh_statistics(nerf_object.object_file.path)
+    nerf_object.vertex_count = statistics['vertex_count']
+    nerf_object.face_count = statistics['face_count']
+    nerf_object.bounding_box = statistics['bounding_box']
+
+    nerf_object.object_size = nerf_object.object_file.size
+    nerf_object.texture_size = nerf_object.texture_file.size
+    nerf_object.material_size = nerf_object.material_file.size
+    with Image.open(nerf_object.texture_file.path) as texture:
+        nerf_object.texture_width, nerf_object.texture_height = texture.size
+
+def convert_nerf_object_meshes(nerf_object: NerfObject) -> None:
+    """ Writes the GLB and the LOD pyramid of the exported OBJ. """
+    mesh = load_obj(nerf_object.object_file.path)
+    with open(nerf_object.texture_file.path, 'rb') as texture:
+        texture_bytes = texture.read()
+
+    convert_nerf_object_to_glb(nerf_object, mesh, texture_bytes)
+    generate_nerf_object_lods(nerf_object, mesh, texture_bytes)
+
+POST_EXPORT_STAGES = [
+    compute_nerf_object_statistics,
+    convert_nerf_object_meshes,
+    generate_nerf_object_textures,
+]
+
+def post_export_nerf_object(nerf_object: NerfObject) -> None:
+    """ Derives everything the download views serve from the files written by ns-export. """
+    nerf_object.object_hash = hash_file(nerf_object.object_file.path)
+    nerf_object.texture_hash = hash_file(nerf_object.texture_file.path)
+    nerf_object.material_hash = hash_file(nerf_object.material_file.path)
+    write_precompressed_variants(nerf_object.object_file.path)
+    write_precompressed_variants(nerf_object.material_file.path)
+
+    # the OBJ is still usable on its own, so a failed stage does not fail the export
+    for stage in POST_EXPORT_STAGES:
+        try:
+            stage(nerf_object)
+        except Exception as e:
+            print(f"[GENERATE_OBJECT_TASK]: {stage.__name__.upper()} ERROR")
+            print(e)
+
+@shared_task(bind=True, acks_late=True, reject_on_worker_lost=True, max_retries=None)
+def generate_nerf_object(self, data: dict, nerf_object_id: int) -> None:
 
     print(data)
     nerf_model_id = data.get('nerf_model')
@@ -110,45 +560,172 @@ def generate_nerf_object(data: dict, nerf_object_id: int) -> None:
     nerf_model = NerfModel.objects.get(id=nerf_model_id)
 
     nerf_object = NerfObject.objects.get(id=nerf_object_id)
+
+    if already_finished(nerf_object, 'GENERATE_OBJECT_TASK'):
+        return
+
+    if not wait_for_upstream(self, nerf_model, nerf_object, 'GENERATE_OBJECT_TASK'):
+        return
+    mark_queued(self, nerf_object, nerf_model)
+    wait_for_turn(self, nerf_object, 'GENERATE_OBJECT_TASK')
     
     try:
 
         export_command = None
         if(os.getenv("USE_TEST_SCRIPT")):
-            export_command = ['python', 'api/scripts/test_nerf_object.py', os.getenv("MAX_TIME_SCRIPT"), os.getenv("MIN_TIME_SCRIPT"), str(nerf_object.id)]
+            export_command = [sys.executable, SIMULATOR_SCRIPT, 'export_object', str(nerf_object.id), '--name', export_method.name]
         else:
-            ns_export_command = f"ns-export {export_method.name} --data media/nerf_models/{nerf_model_id}/{nerf_model.nerf.name}/{nerf}/ --output-dir media/nerf_objects/{nerf_object_id}/"
+            ns_export_command = f"ns-export {export_method.name} --data media/nerf_models/{nerf_model.artifact_id}/{nerf_model.nerf.name}/{nerf}/ --output-dir media/nerf_objects/{nerf_object_id}/"
             export_command = f"{ACTIVATE_NERF_STUDIO_COMMAND} && {ns_export_command}"
         
-        export_result = subprocess.run(export_command)
+        resumed = outputs_complete(f'media/nerf_objects/{nerf_object_id}/')
+        if resumed:
+            print("[GENERATE_OBJECT_TASK]: OUTPUT ALREADY WRITTEN")
+            mark_started(nerf_object)
+            returncode = 0
+        else:
+            # several exports may share this worker process (threads pool), each on a GPU slot
+            with export_slots.acquire() as gpu:
+                # waiting for the slot counts as queue time
+                mark_started(nerf_object)
+                returncode = run_with_progress(export_command, parse_export_line, ProgressTracker(nerf_object),
+                                               settings.EXPORT_OBJECT_TIMEOUT, env={'CUDA_VISIBLE_DEVICES': gpu},
+                                               log_prefix=f'[NERF_OBJECT {nerf_object.id}] ')
             
-        if export_result.returncode == 0:
-            nerf_object.object_file.save('mesh.obj', 
-                                File(open(f'media/nerf_objects/{nerf_object_id}/mesh.obj', 'rb')), 
-                                save=True)
-            nerf_object.texture_file.save('material_0.png', 
-                                File(open(f'media/nerf_objects/{nerf_object_id}/material_0.png', 'rb')), 
-                                save=True)
-            nerf_object.material_file.save(f'material_0.mtl', 
-                                File(open(f'media/nerf_objects/{nerf_object_id}/material_0.mtl', 'rb')), 
-                                save=True)
+        if returncode == 0:
+            mark_outputs_complete(f'media/nerf_objects/{nerf_object_id}/')
+            # ns-export already wrote them where the fields point, saving them again would store suffixed copies
+            nerf_object.object_file.name = upload_directory_obj(nerf_object, 'mesh.obj')
+            nerf_object.texture_file.name = upload_directory_obj(nerf_object, 'material_0.png')
+            nerf_object.material_file.name = upload_directory_obj(nerf_object, 'material_0.mtl')
+            post_export_nerf_object(nerf_object)
             nerf_object.status = 'complete'
             print("[GENERATE_OBJECT_TASK]: SUCCESS")
         else:
             nerf_object.status = 'failed'
             print("[GENERATE_OBJECT_TASK]: RETCODE ERROR (not 0)")
             
-        nerf_object.save_endtime()
+        end_job(nerf_object, 'GENERATE_OBJECT_TASK')
+        if not resumed:
+            record_run(nerf_object)
             
+    except JobCancelled:
+
+        nerf_object.status = 'cancelled'
+        end_job(nerf_object, 'GENERATE_OBJECT_TASK')
+        print("[GENERATE_OBJECT_TASK]: CANCELLED")
+
     except Exception as e:
 
         nerf_object.status = 'failed'
-        nerf_object.save_endtime()
+        end_job(nerf_object, 'GENERATE_OBJECT_TASK')
         print("[GENERATE_OBJECT_TASK]: ERROR")
         print('-- GENERATE_NERF_OBJECT EXCEPTION START --')
         print(e)
         print('-- GENERATE_NERF_OBJECT EXCEPTION END --')
 
+    propagate_result(nerf_object)
+
+def job_signature(instance):
+    """ The task that runs a pipeline row on its own, at the row's priority. """
+    if isinstance(instance, ProcessedData):
+        task = generate_processed_data.si({'user': instance.user_id, 'data': instance.data_id}, instance.id)
+    elif isinstance(instance, NerfModel):
+        task = generate_nerf_model.si({'user': instance.user_id, 'processed_data': instance.processed_data_id,
+                                       'nerf': instance.nerf_id}, instance.id)
+    else:
+        task = generate_nerf_object.si({'user': instance.user_id, 'nerf_model': instance.nerf_model_id,
+                                        'export_method': instance.export_method_id}, instance.id)
+    return task.set(priority=job_priority(instance))
+
+def run_pipeline(user: User, data: Data, nerf: Nerf, export_method: ExportMethod) -> dict:
+    """
+    Creates the ProcessedData, NerfModel and NerfObject rows of a full pipeline and
+    chains their tasks, so each stage starts as soon as the previous one ends.
+    Stages with a cached result are skipped.
+    """
+    processed_data = ProcessedData.objects.create(user=user, data=data)
+    processed_data_cached = link_cached_result(processed_data)
+    nerf_model = NerfModel.objects.create(user=user, processed_data=processed_data, nerf=nerf)
+    nerf_model_cached = link_cached_result(nerf_model)
+    nerf_object = NerfObject.objects.create(user=user, nerf_model=nerf_model, export_method=export_method)
+    nerf_object_cached = link_cached_result(nerf_object)
+
+    stages = []
+    if not processed_data_cached:
+        stages.append(generate_processed_data.si({'user': user.id, 'data': data.id}, processed_data.id).set(priority=job_priority(processed_data)))
+    if not nerf_model_cached:
+        stages.append(generate_nerf_model.si({'user': user.id, 'processed_data': processed_data.id, 'nerf': nerf.id},
+                                             nerf_model.id).set(priority=job_priority(nerf_model)))
+    if not nerf_object_cached:
+        stages.append(generate_nerf_object.si({'user': user.id, 'nerf_model': nerf_model.id, 'export_method': export_method.id},
+                                              nerf_object.id).set(priority=job_priority(nerf_object)))
+    if stages:
+        chain(*stages).delay()
+
+    return {
+        'processed_data': processed_data.id,
+        'nerf_model': nerf_model.id,
+        'nerf_object': nerf_object.id,
+    }
+
+@shared_task
+def finish_sweep(sweep_id: int) -> None:
+    """ Settles a sweep's status once all of its trainings and exports have ended. """
+    sweep = Sweep.objects.get(id=sweep_id)
+    statuses = list(sweep.nerf_objects.values_list('status', flat=True))
+
+    if statuses and all(object_status == 'complete' for object_status in statuses):
+        sweep.status = 'complete'
+    elif any(object_status == 'complete' for object_status in statuses):
+        sweep.status = 'partial'
+    else:
+        sweep.status = 'failed'
+
+    sweep.end_date = timezone.now()
+    sweep.save()
+    print(f"[SWEEP_TASK]: {sweep.status.upper()}")
+
+def run_sweep(user: User, processed_data: ProcessedData, nerfs: [Nerf], export_methods: [ExportMethod]) -> Sweep:
+    """
+    Trains one ProcessedData with every nerf and exports each model with every export method.
+
+    Each training and its exports form a chain, the chains run as a group so that
+    independent trainings spread over all free workers, and a chord callback
+    settles the sweep status at the end. Cached stages are skipped.
+    """
+    sweep = Sweep.objects.create(user=user, processed_data=processed_data)
+    sweep.nerfs.set(nerfs)
+    sweep.export_methods.set(export_methods)
+
+    branches = []
+    for nerf in nerfs:
+        nerf_model = NerfModel.objects.create(user=user, processed_data=processed_data, nerf=nerf, sweep=sweep)
+        train = None
+        if not link_cached_result(nerf_model):
+            train = generate_nerf_model.si({'user': user.id, 'processed_data': processed_data.id, 'nerf': nerf.id},
+                                           nerf_model.id).set(priority=job_priority(nerf_model))
+
+        exports = []
+        for export_method in export_methods:
+            nerf_object = NerfObject.objects.create(user=user, nerf_model=nerf_model,
+                                                    export_method=export_method, sweep=sweep)
+            if not link_cached_result(nerf_object):
+                exports.append(generate_nerf_object.si(
+                    {'user': user.id, 'nerf_model': nerf_model.id, 'export_method': export_method.id},
+                    nerf_object.id).set(priority=job_priority(nerf_object)))
+
+        stages = ([train] if train else []) + ([group(exports)] if exports else [])
+        if stages:
+            branches.append(chain(*stages))
+
+    if branches:
+        chord(branches)(finish_sweep.si(sweep.id))
+    else:
+        finish_sweep.delay(sweep.id)
+
+    return sweep
+
 import requests
 from bs4 import BeautifulSoup
 import json
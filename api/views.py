@@ -41,16 +41,136 @@ class UserLoginView(ObtainAuthToken):
         return Response({'token': token.key, 'user_id': user.pk, 'username': user.username}, status=status.HTTP_200_OK)
 
 # data
-from .models import Data 
+import os
+import re
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.utils import timezone
+from rest_framework.views import APIView
+from .models import Data, DataUpload
 from .serializers import DataUploadSerializer, DataListSerializer, DataSerializer
+from .serializers import DataUploadSessionSerializer, DataUploadCompleteSerializer
+from .uploads import HashingUploadHandler, store_content_addressed, move_content_addressed
+from .utils import hash_file
+
+CONTENT_RANGE_RE = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
 
 class DataUploadView(generics.CreateAPIView):
     queryset = Data.objects.all()
     serializer_class = DataUploadSerializer
     permission_classes = [IsAuthenticated]  
 
+    def initialize_request(self, request, *args, **kwargs):
+        # hash the file while it is received instead of reading it back afterwards; installed
+        # before authentication, whose CSRF check (session auth) already parses the body
+        self.hashing_handler = HashingUploadHandler(request)
+        request.upload_handlers = [self.hashing_handler, *request.upload_handlers]
+        return super().initialize_request(request, *args, **kwargs)
+
     def perform_create(self, serializer):
-        serializer.save(user=self.request.user)
+        data_file = serializer.validated_data['data_file']
+        digest = self.hashing_handler.digests['data_file']
+        serializer.save(user=self.request.user,
+                        data_file=store_content_addressed(data_file, digest),
+                        content_hash=digest)
+
+class DataUploadSessionCreateView(generics.CreateAPIView):
+    """ Opens a resumable upload: the file is then sent with PUTs and finalized with a checksum. """
+    serializer_class = DataUploadSessionSerializer
+    permission_classes = [IsAuthenticated]
+
+    def perform_create(self, serializer):
+        upload = serializer.save(user=self.request.user)
+        part_path = default_storage.path(upload.part_name)
+        os.makedirs(os.path.dirname(part_path), exist_ok=True)
+        open(part_path, 'wb').close()
+
+class DataUploadSessionView(APIView):
+    """
+    GET reports how many bytes were received, so an interrupted client knows where to resume.
+
+    PUT appends the request body at the offset given by `Content-Range: bytes start-end/size`,
+    which must match the bytes received so far. The body is streamed to the file in
+    chunks and never goes through Django's upload handlers.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, upload_id):
+        upload = get_object_or_404(DataUpload, id=upload_id, user=request.user)
+        return Response(DataUploadSessionSerializer(upload).data)
+
+    def put(self, request, upload_id):
+        upload = get_object_or_404(DataUpload, id=upload_id, user=request.user)
+        if upload.status != 'in_progress':
+            return Response({'message': 'Upload is not in progress'}, status=status.HTTP_409_CONFLICT)
+
+        match = CONTENT_RANGE_RE.match(request.META.get('HTTP_CONTENT_RANGE', ''))
+        if not match:
+            return Response({'message': 'A Content-Range: bytes start-end/size header is required'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        start, end, size = (int(value) for value in match.groups())
+        length = end - start + 1
+        if size != upload.size or end >= upload.size or length <= 0:
+            return Response({'message': 'Content-Range does not fit the upload size'},
+                            status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+        if start != upload.offset:
+            return Response({'message': 'Chunk does not start at the current offset', 'offset': upload.offset},
+                            status=status.HTTP_409_CONFLICT)
+
+        written = 0
+        with open(default_storage.path(upload.part_name), 'r+b') as part:
+            part.seek(start)
+            while written < length:
+                chunk = request.stream.read(min(settings.DATA_UPLOAD_CHUNK_SIZE, length - written)) if request.stream else b''
+                if not chunk:
+                    break
+                part.write(chunk)
+                written += len(chunk)
+
+        # a dropped connection still counts the bytes that made it, so the client can resume from there
+        updated = DataUpload.objects.filter(id=upload.id, offset=start).update(offset=start + written)
+        if not updated:
+            return Response({'message': 'Concurrent write to the same upload'}, status=status.HTTP_409_CONFLICT)
+
+        upload.refresh_from_db()
+        return Response(DataUploadSessionSerializer(upload).data)
+
+class DataUploadSessionCompleteView(APIView):
+    """ Checks the size and SHA-256 of a fully sent upload and turns it into a Data row. """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, upload_id):
+        upload = get_object_or_404(DataUpload, id=upload_id, user=request.user)
+        serializer = DataUploadCompleteSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        if upload.status != 'in_progress':
+            return Response({'message': 'Upload is not in progress'}, status=status.HTTP_409_CONFLICT)
+        if upload.offset != upload.size:
+            return Response({'message': 'Upload is incomplete', 'offset': upload.offset},
+                            status=status.HTTP_409_CONFLICT)
+
+        part_path = default_storage.path(upload.part_name)
+        digest = serializer.validated_data['sha256'].lower()
+        if hash_file(part_path) != digest:
+            upload.status = 'failed'
+            upload.end_date = timezone.now()
+            upload.save()
+            os.remove(part_path)
+            return Response({'message': 'Checksum mismatch'}, status=status.HTTP_400_BAD_REQUEST)
+
+        data = Data(user=upload.user, data_type=upload.data_type, name=upload.name,
+                    description=upload.description, content_hash=digest)
+        data.data_file.name = move_content_addressed(part_path, digest, upload.filename)
+        data.save()
+
+        upload.data = data
+        upload.status = 'complete'
+        upload.end_date = timezone.now()
+        upload.save()
+
+        return Response(DataSerializer(data, context={'request': request}).data, status=status.HTTP_201_CREATED)
 
 class UserDataView(generics.ListAPIView):
     serializer_class = DataListSerializer
@@ -75,15 +195,20 @@ class AllDataTypesView(generics.ListAPIView):
 # data
 from .models import ProcessedData
 from .serializers import GenerateProcessedDataSerializer, UserProcessedDataSerializer, ProcessedDataSerializer
-from .utils import generate_processed_data
+from .utils import generate_processed_data, job_priority, link_cached_result
+from .admission import check_admission
+from .predictions import ESTIMATE_RELATED
+from nerfcfm.celery import PROCESS_DATA_QUEUE, TRAIN_MODEL_QUEUE, EXPORT_OBJECT_QUEUE
 
 class GenerateProcessedDataView(generics.CreateAPIView):
     serializer_class = GenerateProcessedDataSerializer
     permission_classes = [IsAuthenticated]
 
     def perform_create(self, serializer):
+        check_admission({PROCESS_DATA_QUEUE: 1})
         processed_data = serializer.save(user=self.request.user)
-        generate_processed_data.delay(serializer.data, processed_data.id)
+        if not link_cached_result(processed_data):
+            generate_processed_data.apply_async((serializer.data, processed_data.id), priority=job_priority(processed_data))
 
 class UserProcessedDataView(generics.ListAPIView):
     serializer_class = UserProcessedDataSerializer
@@ -93,7 +218,7 @@ class UserProcessedDataView(generics.ListAPIView):
         return ProcessedData.objects.filter(user=self.request.user)
 
 class ProcessedDataDetailView(generics.RetrieveAPIView):
-    queryset = ProcessedData.objects.all()
+    queryset = ProcessedData.objects.select_related(*ESTIMATE_RELATED[ProcessedData])
     serializer_class = ProcessedDataSerializer
     lookup_field = 'id'
 
@@ -116,8 +241,10 @@ class GenerateNerfModelView(generics.CreateAPIView):
     serializer_class = GenerateNerfModelSerializer
 
     def perform_create(self, serializer):
+        check_admission({TRAIN_MODEL_QUEUE: 1})
         nerf_model = serializer.save(user=self.request.user)
-        generate_nerf_model.delay(serializer.data, nerf_model.id) 
+        if not link_cached_result(nerf_model):
+            generate_nerf_model.apply_async((serializer.data, nerf_model.id), priority=job_priority(nerf_model))
 
 class UserNerfModelsView(generics.ListAPIView):
     serializer_class = NerfModelListSerializer
@@ -127,7 +254,7 @@ class UserNerfModelsView(generics.ListAPIView):
         return NerfModel.objects.filter(user=self.request.user)
 
 class NerfModelDetailView(generics.RetrieveAPIView):
-    queryset = NerfModel.objects.all()
+    queryset = NerfModel.objects.select_related(*ESTIMATE_RELATED[NerfModel])
     serializer_class = NerfModelSerializer
     lookup_field = 'id'
 
@@ -141,7 +268,12 @@ class AllExportMethodsView(generics.ListAPIView):
 
 # nerf objects
 from .models import NerfObject
-from .serializers import NerfObjectSerializer, GenerateNerfObjectSerializer
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import OrderingFilter
+
+NERF_OBJECT_STATISTICS_FIELDS = ['vertex_count', 'face_count', 'object_size', 'texture_size',
+                                 'material_size', 'texture_width', 'texture_height']
+from .serializers import NerfObjectSerializer, NerfObjectDetailSerializer, GenerateNerfObjectSerializer
 from .utils import generate_nerf_object
 
 class GenerateNerfObjectView(generics.CreateAPIView):
@@ -149,57 +281,352 @@ class GenerateNerfObjectView(generics.CreateAPIView):
     serializer_class = GenerateNerfObjectSerializer
 
     def perform_create(self, serializer):
+        check_admission({EXPORT_OBJECT_QUEUE: 1})
         nerf_object = serializer.save(user=self.request.user)
-        generate_nerf_object.delay(serializer.data, nerf_object.id)
+        if not link_cached_result(nerf_object):
+            generate_nerf_object.apply_async((serializer.data, nerf_object.id), priority=job_priority(nerf_object))
 
 class UserNerfObjectsView(generics.ListAPIView):
     serializer_class = NerfObjectSerializer
     permission_classes = [IsAuthenticated]
+    filter_backends = [OrderingFilter]
+    ordering_fields = NERF_OBJECT_STATISTICS_FIELDS + ['start_date', 'end_date', 'export_time']
 
     def get_queryset(self):
-        return NerfObject.objects.filter(user=self.request.user)
+        queryset = NerfObject.objects.filter(user=self.request.user).prefetch_related('lods')
+
+        # ?min_<field>= / ?max_<field>= range filters over the mesh statistics
+        for field in NERF_OBJECT_STATISTICS_FIELDS:
+            for bound, lookup in (('min', 'gte'), ('max', 'lte')):
+                value = self.request.query_params.get(f'{bound}_{field}')
+                if value is None:
+                    continue
+                if not value.isdigit():
+                    raise ValidationError({f'{bound}_{field}': 'Must be a non-negative integer.'})
+                queryset = queryset.filter(**{f'{field}__{lookup}': int(value)})
+
+        return queryset
 
 class NerfObjectDetailView(generics.RetrieveAPIView):
-    queryset = NerfObject.objects.all()
-    serializer_class = NerfObjectSerializer
+    queryset = NerfObject.objects.select_related(*ESTIMATE_RELATED[NerfObject])
+    serializer_class = NerfObjectDetailSerializer
     lookup_field = 'id'
 
-from django.shortcuts import get_object_or_404
-from django.http import HttpResponse
-from django.core.files import File
-from rest_framework.views import APIView
-from rest_framework.response import Response
-from rest_framework import status
+from rest_framework.negotiation import BaseContentNegotiation
+from .models import NerfObjectLod
+from django.utils.cache import patch_vary_headers
+from .downloads import file_download_response, zip_download_response
+from .textures import TEXTURE_FORMATS
+import zipfile
 
-class MeshNerfObjectView(APIView):
-    def get(self, request, nerf_object_id):
-        nerf_object = get_object_or_404(NerfObject, pk=nerf_object_id)
-        file_path = nerf_object.object_file.path
+class FileContentNegotiation(BaseContentNegotiation):
+    """ File views pick their own content type, so the Accept header must not cause a 406. """
 
-        with open(file_path, 'rb') as file:
-            response = HttpResponse(file.read(), content_type='application/octet-stream')
-            response['Content-Disposition'] = f'inline; filename={nerf_object.object_file.name}'
-            return response
+    def select_parser(self, request, parsers):
+        return parsers[0]
 
-class TextureNerfObjectView(APIView):
-    def get(self, request, nerf_object_id):
-        nerf_object = get_object_or_404(NerfObject, pk=nerf_object_id)
-        file_path = nerf_object.texture_file.path
+    def select_renderer(self, request, renderers, format_suffix=None):
+        return (renderers[0], renderers[0].media_type)
 
-        with open(file_path, 'rb') as file:
-            response = HttpResponse(file.read(), content_type='application/octet-stream')
-            response['Content-Disposition'] = f'inline; filename={nerf_object.texture_file.name}'
-            return response
+class NerfObjectFileView(APIView):
+    content_negotiation_class = FileContentNegotiation
+    file_field = None
+    hash_field = None
+    content_type = 'application/octet-stream'
+    precompressed = False
+    vary_headers = []
+
+    def get_file(self, request, nerf_object):
+        return getattr(nerf_object, self.file_field), getattr(nerf_object, self.hash_field), self.content_type
 
-class MaterialNerfObjectView(APIView):
     def get(self, request, nerf_object_id):
         nerf_object = get_object_or_404(NerfObject, pk=nerf_object_id)
-        file_path = nerf_object.material_file.path
+        file, content_hash, content_type = self.get_file(request, nerf_object)
+        if not file:
+            return Response({'message': 'File not available for this object'}, status=status.HTTP_404_NOT_FOUND)
+
+        response = file_download_response(request, file,
+                                          content_type=content_type,
+                                          content_hash=content_hash,
+                                          last_modified=nerf_object.end_date,
+                                          precompressed=self.precompressed)
+        patch_vary_headers(response, self.vary_headers)
+        return response
+
+class NerfObjectLodFileView(NerfObjectFileView):
+    """ Serves the full resolution file, or the `?lod=` decimated level of it. """
+
+    def get_file(self, request, nerf_object):
+        lod = request.query_params.get('lod')
+        if not lod or lod == '0':
+            return super().get_file(request, nerf_object)
+        if not lod.isdigit():
+            raise ValidationError({'lod': 'Must be a non-negative integer.'})
+
+        nerf_object_lod = get_object_or_404(NerfObjectLod, nerf_object=nerf_object, level=int(lod))
+        return getattr(nerf_object_lod, self.file_field), getattr(nerf_object_lod, self.hash_field), self.content_type
+
+class MeshNerfObjectView(NerfObjectLodFileView):
+    file_field = 'object_file'
+    hash_field = 'object_hash'
+    precompressed = True
+
+class TextureNerfObjectView(NerfObjectFileView):
+    """
+    Serves the exported texture, or with `?size=` the smallest stored level at least
+    that large. WebP is sent with `?type=webp` or when the client accepts it.
+    """
+    file_field = 'texture_file'
+    hash_field = 'texture_hash'
+    vary_headers = ['Accept']
+
+    def get_file(self, request, nerf_object):
+        size = request.query_params.get('size')
+        texture_format = request.query_params.get('type')
+        if texture_format is None and 'image/webp' in request.META.get('HTTP_ACCEPT', ''):
+            texture_format = 'webp'
+        texture_format = texture_format or 'png'
+
+        if size and not size.isdigit():
+            raise ValidationError({'size': 'Must be a positive integer.'})
+        if texture_format not in TEXTURE_FORMATS:
+            raise ValidationError({'type': f'Must be one of {", ".join(TEXTURE_FORMATS)}.'})
+
+        textures = nerf_object.textures.filter(format=texture_format)
+        texture = textures.filter(size__gte=int(size)).order_by('size').first() if size else None
+
+        # the exported png is the full resolution level, webp has a stored one
+        if texture is None and texture_format == 'webp':
+            texture = textures.order_by('-size').first()
+        if texture is None:
+            return super().get_file(request, nerf_object)
+
+        return texture.texture_file, texture.texture_hash, TEXTURE_FORMATS[texture_format]['content_type']
+
+class MaterialNerfObjectView(NerfObjectFileView):
+    file_field = 'material_file'
+    hash_field = 'material_hash'
+    precompressed = True
+
+class GlbNerfObjectView(NerfObjectLodFileView):
+    file_field = 'glb_file'
+    hash_field = 'glb_hash'
+    content_type = 'model/gltf-binary'
+
+class BundleNerfObjectView(APIView):
+    def get(self, request, nerf_object_id):
+        nerf_object = get_object_or_404(NerfObject, pk=nerf_object_id)
+        if not (nerf_object.object_file and nerf_object.material_file and nerf_object.texture_file):
+            return Response({'message': 'Files not available for this object'}, status=status.HTTP_404_NOT_FOUND)
+
+        # the png is already compressed, only the text files are worth deflating
+        files = [
+            (nerf_object.object_file.path, os.path.basename(nerf_object.object_file.name), zipfile.ZIP_DEFLATED),
+            (nerf_object.material_file.path, os.path.basename(nerf_object.material_file.name), zipfile.ZIP_DEFLATED),
+            (nerf_object.texture_file.path, os.path.basename(nerf_object.texture_file.name), zipfile.ZIP_STORED),
+        ]
+        return zip_download_response(files, f'nerf_object_{nerf_object.id}.zip')
+
+# batch generation
+from celery import group
+from .serializers import BatchGenerateProcessedDataSerializer, BatchGenerateNerfModelSerializer, BatchGenerateNerfObjectSerializer
+from .utils import create_batch
+
+class BatchGenerateView(generics.GenericAPIView):
+    """ Creates many jobs of one stage in a single transaction and queues their tasks as one group. """
+    permission_classes = [IsAuthenticated]
+    model = None
+    task = None
+    job_serializer_class = None
+    stage = None
 
-        with open(file_path, 'rb') as file:
-            response = HttpResponse(file.read(), content_type='application/octet-stream')
-            response['Content-Disposition'] = f'inline; filename={nerf_object.material_file.name}'
-            return response
+    def post(self, request):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        check_admission({self.stage: len(serializer.validated_data['jobs'])})
+
+        rows, pending = create_batch(self.model, request.user, serializer.validated_data['jobs'])
+        tasks = [self.task.si(self.job_serializer_class(row).data, row.id).set(priority=job_priority(row))
+                 for row in pending]
+        if tasks:
+            group(tasks).delay()
+
+        return Response({'ids': [row.id for row in rows]}, status=status.HTTP_201_CREATED)
+
+class BatchGenerateProcessedDataView(BatchGenerateView):
+    serializer_class = BatchGenerateProcessedDataSerializer
+    model = ProcessedData
+    task = generate_processed_data
+    job_serializer_class = GenerateProcessedDataSerializer
+    stage = PROCESS_DATA_QUEUE
+
+class BatchGenerateNerfModelView(BatchGenerateView):
+    serializer_class = BatchGenerateNerfModelSerializer
+    model = NerfModel
+    task = generate_nerf_model
+    job_serializer_class = GenerateNerfModelSerializer
+    stage = TRAIN_MODEL_QUEUE
+
+class BatchGenerateNerfObjectView(BatchGenerateView):
+    serializer_class = BatchGenerateNerfObjectSerializer
+    model = NerfObject
+    task = generate_nerf_object
+    job_serializer_class = GenerateNerfObjectSerializer
+    stage = EXPORT_OBJECT_QUEUE
+
+# pipeline
+from .serializers import RunPipelineSerializer
+from .utils import run_pipeline
+
+class RunPipelineView(generics.GenericAPIView):
+    permission_classes = [IsAuthenticated]
+    serializer_class = RunPipelineSerializer
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        check_admission({PROCESS_DATA_QUEUE: 1, TRAIN_MODEL_QUEUE: 1, EXPORT_OBJECT_QUEUE: 1})
+        pipeline = run_pipeline(request.user, **serializer.validated_data)
+        return Response(pipeline, status=status.HTTP_201_CREATED)
+
+# sweeps
+from .models import Sweep
+from .serializers import RunSweepSerializer, SweepSerializer
+from .utils import run_sweep
+
+SWEEP_PREFETCH = ['nerfs', 'export_methods', 'nerf_objects', 'nerf_models__nerfobject_set']
+
+class RunSweepView(generics.GenericAPIView):
+    permission_classes = [IsAuthenticated]
+    serializer_class = RunSweepSerializer
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        nerfs, export_methods = serializer.validated_data['nerfs'], serializer.validated_data['export_methods']
+        check_admission({TRAIN_MODEL_QUEUE: len(nerfs), EXPORT_OBJECT_QUEUE: len(nerfs) * len(export_methods)})
+        sweep = run_sweep(request.user, **serializer.validated_data)
+        sweep = Sweep.objects.prefetch_related(*SWEEP_PREFETCH).get(id=sweep.id)
+        return Response(SweepSerializer(sweep).data, status=status.HTTP_201_CREATED)
+
+class UserSweepsView(generics.ListAPIView):
+    serializer_class = SweepSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        return Sweep.objects.filter(user=self.request.user).prefetch_related(*SWEEP_PREFETCH)
+
+class SweepDetailView(generics.RetrieveAPIView):
+    serializer_class = SweepSerializer
+    permission_classes = [IsAuthenticated]
+    lookup_field = 'id'
+
+    def get_queryset(self):
+        return Sweep.objects.filter(user=self.request.user).prefetch_related(*SWEEP_PREFETCH)
+
+# job progress
+from .serializers import JobProgressSerializer
+
+PROGRESS_FIELDS = ['status', 'progress', 'progress_stage', 'start_date', 'queued_at', 'started_at', 'estimated_end_date', 'cache_source']
+
+class JobProgressView(generics.RetrieveAPIView):
+    """ Progress of a pipeline job, cheap enough to poll while it runs. """
+    serializer_class = JobProgressSerializer
+    lookup_field = 'id'
+    model = None
+
+    def get_queryset(self):
+        return self.model.objects.only(*PROGRESS_FIELDS)
+
+    def get_object(self):
+        job = super().get_object()
+        # a job that joined a running one reports the progress of the one doing the work
+        if job.status == 'in_progress' and job.cache_source_id:
+            source = self.get_queryset().get(id=job.cache_source_id)
+            job.progress, job.progress_stage, job.estimated_end_date = (
+                source.progress, source.progress_stage, source.estimated_end_date)
+        return job
+
+class ProcessedDataProgressView(JobProgressView):
+    model = ProcessedData
+
+class NerfModelProgressView(JobProgressView):
+    model = NerfModel
+
+class NerfObjectProgressView(JobProgressView):
+    model = NerfObject
+
+# job cancellation
+from .utils import end_job, propagate_result
+
+class CancelJobView(generics.GenericAPIView):
+    """
+    Cancels a queued or running job; a running command is killed by its task's watchdog.
+    Rows that reused the job, possibly other users', are not cancelled with it.
+    """
+    permission_classes = [IsAuthenticated]
+    serializer_class = JobProgressSerializer
+    model = None
+
+    def post(self, request, id):
+        job = get_object_or_404(self.model, id=id, user=request.user)
+        if job.status != 'in_progress':
+            return Response({'message': 'Job is not in progress'}, status=status.HTTP_409_CONFLICT)
+
+        # the task may have ended the job since it was read
+        job.status = 'cancelled'
+        if not end_job(job, 'CANCEL_JOB'):
+            return Response({'message': 'Job is not in progress'}, status=status.HTTP_409_CONFLICT)
+        propagate_result(job)
+        return Response(JobProgressSerializer(job).data)
+
+class CancelProcessedDataView(CancelJobView):
+    model = ProcessedData
+
+class CancelNerfModelView(CancelJobView):
+    model = NerfModel
+
+class CancelNerfObjectView(CancelJobView):
+    model = NerfObject
+
+# job events
+from asgiref.sync import sync_to_async
+from django.apps import apps
+from django.http import HttpResponse, StreamingHttpResponse
+from .events import job_event_stream
+
+async def get_event_stream_user(request):
+    """ Token (header, or `?token=` since EventSource cannot set headers) or session user. """
+    key = request.GET.get('token')
+    authorization = request.headers.get('Authorization', '')
+    if authorization.startswith('Token '):
+        key = authorization[len('Token '):]
+    if key and apps.is_installed('rest_framework.authtoken'):
+        token = await Token.objects.select_related('user').filter(key=key).afirst()
+        return token.user if token else None
+    return await sync_to_async(lambda: request.user if request.user.is_authenticated else None)()
+
+async def job_events_view(request):
+    """ Server-Sent Events stream of the status and progress changes of the user's jobs. """
+    user = await get_event_stream_user(request)
+    if user is None:
+        return HttpResponse(status=status.HTTP_401_UNAUTHORIZED)
+    if not settings.JOB_EVENTS_REDIS_URL:
+        return HttpResponse(status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+    response = StreamingHttpResponse(job_event_stream(user), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+# metrics
+from .metrics import render_metrics
+
+def metrics_view(request):
+    """ Prometheus scrape endpoint: job counts, queue depths and job latency histograms per stage. """
+    if settings.METRICS_TOKEN and request.headers.get('Authorization') != f'Bearer {settings.METRICS_TOKEN}':
+        return HttpResponse(status=status.HTTP_401_UNAUTHORIZED)
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
 
 # reviews
 from .models import Review
@@ -9,8 +9,15 @@ https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
 
 import os
 
+from django.conf import settings
+from django.contrib.staticfiles.handlers import ASGIStaticFilesHandler
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'nerfcfm.settings')
 
 application = get_asgi_application()
+
+# uvicorn does not serve static files as runserver does; in production, collect them
+# and let the front server serve STATIC_URL (see the README)
+if settings.DEBUG:
+    application = ASGIStaticFilesHandler(application)
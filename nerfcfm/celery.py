@@ -1,7 +1,10 @@
 # celery.py
 from __future__ import absolute_import, unicode_literals
 import os
+import time
 from celery import Celery
+from celery.signals import before_task_publish, celeryd_init
+from kombu import Queue
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'nerfcfm.settings')
 
@@ -9,4 +12,59 @@ app = Celery('nerfcfm')
 
 app.config_from_object('django.conf:settings', namespace='CELERY')
 
-app.autodiscover_tasks()
\ No newline at end of file
+# One queue per pipeline stage, so cheap exports never wait behind long trainings
+# and CPU-bound processing does not share a worker with GPU training.
+# Start one worker per queue, e.g. `celery -A nerfcfm.celery worker -Q train_model`.
+PROCESS_DATA_QUEUE = 'process_data'
+TRAIN_MODEL_QUEUE = 'train_model'
+EXPORT_OBJECT_QUEUE = 'export_object'
+
+# Worker processes (threads with --pool threads) of each stage queue, used when the worker is started without -c.
+QUEUE_CONCURRENCY = {
+    PROCESS_DATA_QUEUE: int(os.getenv('PROCESS_DATA_CONCURRENCY', 2)),
+    TRAIN_MODEL_QUEUE: int(os.getenv('TRAIN_MODEL_CONCURRENCY', 1)),
+    EXPORT_OBJECT_QUEUE: int(os.getenv('EXPORT_OBJECT_CONCURRENCY', 4)),
+}
+
+# Priorities go from 0 (runs first) to MAX_PRIORITY, as the redis transport orders them.
+MAX_PRIORITY = 9
+
+app.conf.task_default_queue = 'celery'
+app.conf.task_queues = [
+    Queue(name, queue_arguments={'x-max-priority': MAX_PRIORITY})
+    for name in ['celery', PROCESS_DATA_QUEUE, TRAIN_MODEL_QUEUE, EXPORT_OBJECT_QUEUE]
+]
+app.conf.task_routes = {
+    'api.utils.generate_processed_data': {'queue': PROCESS_DATA_QUEUE},
+    'api.utils.generate_nerf_model': {'queue': TRAIN_MODEL_QUEUE},
+    'api.utils.generate_nerf_object': {'queue': EXPORT_OBJECT_QUEUE},
+}
+app.conf.broker_transport_options = {
+    'queue_order_strategy': 'priority',
+    'priority_steps': list(range(MAX_PRIORITY + 1)),
+    'sep': ':',
+    # pipeline tasks are acknowledged late, so redis redelivers any job unacknowledged for
+    # this long: it must outlast the longest training (TRAIN_MODEL_TIMEOUT)
+    'visibility_timeout': int(os.getenv('CELERY_VISIBILITY_TIMEOUT', 25 * 60 * 60)),
+}
+# Jobs run for minutes to hours: a worker reserves only the job it is running,
+# so queued jobs stay available to idle workers and to higher priority jobs.
+app.conf.worker_prefetch_multiplier = 1
+
+@celeryd_init.connect
+def set_queue_concurrency(sender=None, conf=None, options=None, **kwargs):
+    """ Sizes a worker that consumes a single stage queue from QUEUE_CONCURRENCY. """
+    if options.get('concurrency'):
+        return
+    queues = options.get('queues') or []
+    if isinstance(queues, str):
+        queues = queues.split(',')
+    if len(queues) == 1 and queues[0] in QUEUE_CONCURRENCY:
+        conf.worker_concurrency = QUEUE_CONCURRENCY[queues[0]]
+
+@before_task_publish.connect
+def stamp_queued_at(headers=None, **kwargs):
+    """ Records on the message when the task was published, read by the task as `self.request.queued_at`. """
+    headers.setdefault('queued_at', time.time())
+
+app.autodiscover_tasks()
@@ -157,3 +157,109 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# File downloads
+# Set to 'x-sendfile' (Apache) or 'x-accel-redirect' (nginx) to let the front
+# server transfer artifact files instead of the Django worker.
+FILE_SERVE_OFFLOAD = os.getenv('FILE_SERVE_OFFLOAD')
+FILE_SERVE_ACCEL_PREFIX = os.getenv('FILE_SERVE_ACCEL_PREFIX', '/protected-media/')
+# Exported artifacts never change once written, so clients may cache them for a year.
+ARTIFACT_CACHE_MAX_AGE = int(os.getenv('ARTIFACT_CACHE_MAX_AGE', 60 * 60 * 24 * 365))
+# Brotli quality (0-11) of the .br siblings written next to exported meshes, when the
+# optional `brotli` package is installed. Above 6 it can hold an export worker for
+# minutes per large mesh, for little gain.
+PRECOMPRESSED_BROTLI_QUALITY = int(os.getenv('PRECOMPRESSED_BROTLI_QUALITY', 5))
+
+# Fractions of the exported faces kept by each mesh level of detail; 1.0 is the export itself.
+NERF_OBJECT_LOD_RATIOS = [float(ratio) for ratio in os.getenv('NERF_OBJECT_LOD_RATIOS', '1.0,0.25,0.05').split(',')]
+
+# Longest side, in pixels, of the downscaled texture levels, and the one used for thumbnails.
+NERF_OBJECT_TEXTURE_SIZES = [int(size) for size in os.getenv('NERF_OBJECT_TEXTURE_SIZES', '2048,1024,512,256,128').split(',')]
+NERF_OBJECT_TEXTURE_WEBP_QUALITY = int(os.getenv('NERF_OBJECT_TEXTURE_WEBP_QUALITY', 80))
+NERF_OBJECT_THUMBNAIL_SIZE = int(os.getenv('NERF_OBJECT_THUMBNAIL_SIZE', 128))
+
+# Bytes read from the request body at a time when writing resumable upload chunks.
+DATA_UPLOAD_CHUNK_SIZE = int(os.getenv('DATA_UPLOAD_CHUNK_SIZE', 1024 * 1024))
+
+# How often, and how many times, a stage re-checks an upstream job that is still running.
+PIPELINE_UPSTREAM_RETRY_DELAY = int(os.getenv('PIPELINE_UPSTREAM_RETRY_DELAY', 30))
+PIPELINE_UPSTREAM_MAX_RETRIES = int(os.getenv('PIPELINE_UPSTREAM_MAX_RETRIES', 2 * 60 * 24))
+
+# Priority of a job within its stage queue, from 0 (runs first) to 9. Faster nerfs and
+# lighter export methods jump ahead so they don't starve behind heavy jobs.
+CELERY_TASK_DEFAULT_PRIORITY = int(os.getenv('CELERY_TASK_DEFAULT_PRIORITY', 5))
+NERF_PRIORITIES = {
+    'instant-ngp': 3,
+    'splatfacto': 4,
+}
+EXPORT_METHOD_PRIORITIES = {
+    'pointcloud': 2,
+    'tsdf': 4,
+}
+
+# Minimum seconds between two progress writes of a running job.
+PROGRESS_UPDATE_INTERVAL = float(os.getenv('PROGRESS_UPDATE_INTERVAL', 5))
+
+# Redis pub/sub behind the job event streams; empty disables publishing.
+JOB_EVENTS_REDIS_URL = os.getenv('JOB_EVENTS_REDIS_URL', CELERY_BROKER_URL)
+JOB_EVENTS_CHANNEL_PREFIX = 'job-events:'
+# Seconds between keepalive comments on an idle stream.
+JOB_EVENTS_HEARTBEAT = int(os.getenv('JOB_EVENTS_HEARTBEAT', 15))
+# Seconds a stream stays open before it ends and the client reconnects, after
+# JOB_EVENTS_RECONNECT_DELAY seconds. Bounds how long a stream whose client left lingers.
+JOB_EVENTS_MAX_DURATION = int(os.getenv('JOB_EVENTS_MAX_DURATION', 5 * 60))
+JOB_EVENTS_RECONNECT_DELAY = int(os.getenv('JOB_EVENTS_RECONNECT_DELAY', 1))
+
+# Wall-clock limit, in seconds, of each pipeline stage's command; 0 disables it.
+PROCESS_DATA_TIMEOUT = int(os.getenv('PROCESS_DATA_TIMEOUT', 4 * 60 * 60))
+TRAIN_MODEL_TIMEOUT = int(os.getenv('TRAIN_MODEL_TIMEOUT', 24 * 60 * 60))
+EXPORT_OBJECT_TIMEOUT = int(os.getenv('EXPORT_OBJECT_TIMEOUT', 2 * 60 * 60))
+# How often a running job checks for cancellation, and how long a killed command
+# gets to exit on SIGTERM before SIGKILL.
+JOB_CANCEL_POLL_INTERVAL = float(os.getenv('JOB_CANCEL_POLL_INTERVAL', 5))
+JOB_KILL_GRACE_PERIOD = float(os.getenv('JOB_KILL_GRACE_PERIOD', 10))
+
+# Most jobs accepted by one batch generate request.
+BATCH_GENERATE_MAX_SIZE = int(os.getenv('BATCH_GENERATE_MAX_SIZE', 1000))
+
+# GPUs an export worker spreads its commands over, and how many exports each one
+# runs at once when the worker uses the threads pool (see docker-compose).
+EXPORT_GPUS = os.getenv('EXPORT_GPUS', '0').split(',')
+EXPORT_SLOTS_PER_GPU = int(os.getenv('EXPORT_SLOTS_PER_GPU', 4))
+
+# Upper bounds, in seconds, of the buckets of the job latency histograms at /api/metrics/.
+METRICS_LATENCY_BUCKETS = [10, 30, 60, 2 * 60, 5 * 60, 10 * 60, 30 * 60, 60 * 60, 2 * 60 * 60, 4 * 60 * 60, 8 * 60 * 60, 24 * 60 * 60]
+# Bearer token Prometheus scrapes /api/metrics/ with; empty leaves the endpoint open.
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+
+# Admission control of the generate, batch, pipeline and sweep endpoints: most jobs a
+# stage may have queued before new ones get a 429 (0 disables it), with a Retry-After
+# of the time its workers need to drain the excess.
+ADMISSION_MAX_BACKLOG = {
+    'process_data': int(os.getenv('PROCESS_DATA_MAX_BACKLOG', 200)),
+    'train_model': int(os.getenv('TRAIN_MODEL_MAX_BACKLOG', 50)),
+    'export_object': int(os.getenv('EXPORT_OBJECT_MAX_BACKLOG', 200)),
+}
+# Below this many free bytes in MEDIA_ROOT, new jobs get a 503 (0 disables it).
+ADMISSION_MIN_FREE_DISK = int(os.getenv('ADMISSION_MIN_FREE_DISK', 5 * 1024 ** 3))
+ADMISSION_DISK_RETRY_AFTER = 10 * 60
+
+# Run time predictions (see api/predictions.py): runs of a DataType, Nerf or ExportMethod
+# needed before its own stats are used over those of the whole stage, and the seconds
+# assumed while a stage has no completed run yet.
+PREDICTION_MIN_SAMPLES = int(os.getenv('PREDICTION_MIN_SAMPLES', 5))
+PREDICTION_DEFAULT_RUN_TIMES = {
+    'process_data': 10 * 60,
+    'train_model': 30 * 60,
+    'export_object': 5 * 60,
+}
+
+# Fair share of the GPU stages between users (see api/fairshare.py): jobs a user may run
+# at once per stage (0 for no cap, UserQuota overrides it per user), the window over which
+# GPU-seconds are compared, and how long a task waiting for its turn sleeps between checks.
+FAIR_SHARE_MAX_RUNNING = {
+    'train_model': int(os.getenv('TRAIN_MODEL_USER_CAP', 2)),
+    'export_object': int(os.getenv('EXPORT_OBJECT_USER_CAP', 4)),
+}
+FAIR_SHARE_WINDOW = int(os.getenv('FAIR_SHARE_WINDOW', 24 * 60 * 60))
+FAIR_SHARE_RETRY_DELAY = int(os.getenv('FAIR_SHARE_RETRY_DELAY', 15))